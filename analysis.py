@@ -9,24 +9,71 @@
 from modules.loading import *
 from modules.counting import *
 from modules.randomisation import *
+from modules.cache import *
+from modules.incremental import update_files
+from modules.partition import count_out_of_core
+from modules.instrument import enable, stage, report
 import os
+import argparse
         
 def main():
-    # Load data
-    dict_teams = load_teams('assignment-final-data/team_ids.txt')
-    dict_cheaters = load_cheaters('assignment-final-data/cheaters.txt')
-    dict_kills = load_kills('assignment-final-data/kills.txt', dict_cheaters)
+    parser = argparse.ArgumentParser(description='Cheating analysis.')
+    parser.add_argument('--report', default='analysis-report.json',
+                        help='JSON file for the timing and memory report')
+    parser.add_argument('--profile', action='store_true',
+                        help='also run cProfile and add the top functions to the report')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='do not trace peak memory per stage')
+    parser.add_argument('--incremental', nargs=3, metavar=('TEAMS', 'KILLS', 'CHEATERS'),
+                        help="apply the day's new rows of team_ids.txt and kills.txt and "
+                             'the current cheaters.txt to the saved counts, instead of '
+                             'the full analysis')
+    parser.add_argument('--state', default='assignment-final-data/incremental.db',
+                        help='state of the incremental counts')
+    parser.add_argument('--out-of-core', nargs=3, metavar=('TEAMS', 'KILLS', 'CHEATERS'),
+                        help='count logs larger than memory shard by shard, instead of '
+                             'the full analysis')
+    args = parser.parse_args()
+    
+    # Record wall time, CPU time and memory of every loader, randomiser and 
+    # counter
+    enable(memory=not args.no_memory, profile=args.profile)
+    
+    # Nightly job: update the counts with the day's data only
+    if args.incremental:
+        with stage('incremental', 'task'):
+            count_incremental(*args.incremental, state_path=args.state)
+        report(args.report)
+        print(f'\n--- Report written to {args.report} ---')
+        return
+    
+    # Logs larger than memory: observed counts, one shard at a time
+    if args.out_of_core:
+        with stage('out of core', 'task'):
+            count_sharded(*args.out_of_core)
+        report(args.report)
+        print(f'\n--- Report written to {args.report} ---')
+        return
+    
+    # Load data; parsed files are cached on disk and memory-mapped. Cheaters
+    # are held in a CheaterIndex, which the counting functions accept in 
+    # place of the dict
+    with stage('loading', 'task'):
+        dataset = load_dataset_cached('assignment-final-data/team_ids.txt',
+                                      'assignment-final-data/kills.txt')
+        dict_cheaters = load_cheater_index_cached('assignment-final-data/cheaters.txt')
     
     #---- Task 1: Counting cheaters and expectation
-    count_cheaters(dict_teams, dict_cheaters)
+    with stage('task 1', 'task'):
+        count_cheaters(dataset, dict_cheaters)
     print('\n-------------\n-------------\n-------------\n')
 
-    #---- Task 2: Counting victims and expectation
-    count_victims(dict_kills, dict_cheaters)
-    print('\n-------------\n-------------\n-------------\n')
-        
-    #---- Task 3: Counting observers and expectation
-    count_observers(dict_kills, dict_cheaters)
+    #---- Tasks 2 and 3: Counting victims and observers and expectation
+    with stage('tasks 2 and 3', 'task'):
+        count_victims_observers(dataset, dict_cheaters)
+    
+    report(args.report)
+    print(f'\n--- Report written to {args.report} ---')
 
 
 # -----------------------------------------------------------------------------
@@ -66,6 +113,44 @@ def count_observers(dict_kills:dict, dict_cheaters: dict):
     '''
     count_observers_cheaters_out(dict_kills, dict_cheaters)
     exp_count_observers_cheaters(dict_kills, dict_cheaters)
+
+def count_victims_observers(dict_kills:dict, dict_cheaters: dict):
+    ''' Takes kills data (dict_kills) and cheaters data (dict_cheaters).
+        Calls count_contagion_out() to output counts of victims and observers
+        who became cheaters.
+        Calls exp_count_contagion() to output the expected counts of both,
+        from the same randomised worlds.
+        Returns none.
+    '''
+    count_contagion_out(dict_kills, dict_cheaters)
+    exp_count_contagion(dict_kills, dict_cheaters)
+
+def count_incremental(teams_path: str, kills_path: str, cheaters_path: str,
+                      state_path: str = 'assignment-final-data/incremental.db'):
+    ''' Takes paths to the day's new rows of team_ids.txt (teams_path) and
+        kills.txt (kills_path), the current cheaters.txt (cheaters_path) and
+        the saved state (state_path).
+        Calls update_files() to re-evaluate only the new or changed matches
+        and those of players whose cheater entry changed, and output updated
+        counts.
+        Returns none.
+    '''
+    update_files(state_path, teams_path, kills_path, cheaters_path)
+
+def count_sharded(teams_path: str, kills_path: str, cheaters_path: str):
+    ''' Takes paths to team_ids.txt (teams_path), kills.txt (kills_path) and
+        cheaters.txt (cheaters_path), for logs larger than memory.
+        Calls count_out_of_core() to count shard by shard, and outputs the
+        counts.
+        Returns none.
+    '''
+    histogram, victims, observers = count_out_of_core(teams_path, kills_path,
+                                                      load_cheaters(cheaters_path))
+    print('--- Number of cheaters per team ---')
+    for num_cheater, count in histogram.items():
+        print(f'\tTeams with {num_cheater} cheaters: {count}')
+    print(f'\tNumber of victims becoming cheaters: {len(victims)}')
+    print(f'\tNumber of observers becoming cheaters: {len(observers)}')
     
 if __name__ == '__main__':
     main()
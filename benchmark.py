@@ -0,0 +1,272 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File benchmarks the loaders, counters and expectations on synthetic data
+# 1. Measurements
+# 2. Benchmarks
+# 3. Results
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import os
+import io
+import gc
+import json
+import time
+import platform
+import argparse
+import contextlib
+import subprocess
+import tracemalloc
+import numpy as np
+from modules.loading import *
+from modules.counting import *
+from modules.randomisation import *
+from modules.dataset import load_dataset
+from modules.ingest import ingest, load_cheater_index
+from modules.synthetic import generate_data
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 1000000, 10000000],
+                        help='numbers of matches')
+    parser.add_argument('--data-dir', default='benchmarks/data',
+                        help='directory for the synthetic data, reused across runs')
+    parser.add_argument('--output', default=None,
+                        help='JSON file for the results (default: benchmarks/<commit>.json)')
+    parser.add_argument('--compare', default=None,
+                        help='JSON file of an earlier run to compare against')
+    parser.add_argument('--reps', type=int, default=20,
+                        help='repetitions of the exp_count_* functions')
+    parser.add_argument('--dict-limit', type=int, default=100000,
+                        help='largest number of matches for dict-based functions')
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='run only benchmarks whose name contains one of these')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the tracemalloc pass')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.data_dir, args.reps, args.dict_limit,
+                             args.only, not args.no_memory)
+    report = {'meta': metadata(args), 'results': results}
+
+    output = args.output or os.path.join('benchmarks', f'{report["meta"]["commit"] or "results"}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=1)
+    print(f'--- Results written to {output} ---')
+
+    if args.compare:
+        compare(args.compare, report)
+
+# -----------------------------------------------------------------------------
+# 1. Measurements
+# Wall and CPU time come from an untraced run. Peak memory comes from a second
+# run under tracemalloc, which numpy reports its buffers to.
+# -----------------------------------------------------------------------------
+
+def measure(function, memory: bool = True) -> dict:
+    '''Takes a function without arguments (function) and bool (memory)
+           whether to measure peak memory.
+       Runs the function with its printed output suppressed.
+       Returns a dict with wall and CPU time in seconds and the peak of
+           traced memory in MB, or None if not measured.
+    '''
+    gc.collect()
+    with contextlib.redirect_stdout(io.StringIO()):
+        wall, cpu = time.perf_counter(), time.process_time()
+        function()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+        peak = None
+        if memory:
+            gc.collect()
+            tracemalloc.start()
+            try:
+                function()
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            finally:
+                tracemalloc.stop()
+
+    return {'wall_s': wall, 'cpu_s': cpu, 'peak_mb': peak}
+
+def metadata(args) -> dict:
+    '''Takes the parsed arguments (args).
+       Returns a dict describing the code version, machine and settings.
+    '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'reps': args.reps,
+            'dict_limit': args.dict_limit}
+
+# -----------------------------------------------------------------------------
+# 2. Benchmarks
+# Format: (name, stage, dict-based, function of the loaded data)
+# Dict-based functions loop in Python and are skipped above dict_limit
+# -----------------------------------------------------------------------------
+
+def benchmarks(paths: dict, reps: int) -> list:
+    '''Takes the paths of the synthetic files (paths) and the number of
+           repetitions (reps).
+       Returns a list of (name, stage, dict-based, function) tuples; each
+           function takes the dict of loaded data.
+    '''
+    teams, kills, cheaters = paths['team_ids'], paths['kills'], paths['cheaters']
+
+    return [
+        ('load_teams', 'load', True, lambda data: load_teams(teams)),
+        ('load_kills', 'load', True, lambda data: load_kills(kills)),
+        ('load_cheaters', 'load', True, lambda data: load_cheaters(cheaters)),
+        ('load_dataset', 'load', True, lambda data: load_dataset(teams, kills)),
+        ('ingest', 'load', False, lambda data: ingest(teams, kills, cheaters)),
+        ('load_cheater_index', 'load', False, lambda data: load_cheater_index(cheaters)),
+
+        ('count_cheaters[dict]', 'count', True,
+         lambda data: count_cheaters(data['teams'], data['cheaters'])),
+        ('count_cheaters[columnar]', 'count', False,
+         lambda data: count_cheaters(data['dataset'], data['index'])),
+        ('count_victims_cheaters[dict]', 'count', True,
+         lambda data: count_victims_cheaters(data['kills'], data['cheaters'])),
+        ('count_victims_cheaters[columnar]', 'count', False,
+         lambda data: count_victims_cheaters(data['dataset'], data['index'])),
+        ('count_observers_cheaters[dict]', 'count', True,
+         lambda data: count_observers_cheaters(data['kills'], data['cheaters'])),
+        ('count_observers_cheaters[columnar]', 'count', False,
+         lambda data: count_observers_cheaters(data['dataset'], data['index'])),
+        ('count_contagion[columnar]', 'count', False,
+         lambda data: count_contagion(data['dataset'], data['index'])),
+
+        ('exp_count_cheaters[dict]', 'expect', True,
+         lambda data: exp_count_cheaters(data['teams'], data['cheaters'],
+                                         randomise_team_ids, reps)),
+        ('exp_count_cheaters[columnar]', 'expect', False,
+         lambda data: exp_count_cheaters(data['dataset'], data['index'], reps=reps, seed=0)),
+        ('exp_count_cheaters_exact[columnar]', 'expect', False,
+         lambda data: exp_count_cheaters_exact(data['dataset'], data['index'])),
+        ('exp_count_victims_cheaters[dict]', 'expect', True,
+         lambda data: exp_count_victims_cheaters(data['kills'], data['cheaters'],
+                                                 randomise_player_ids, reps)),
+        ('exp_count_victims_cheaters[columnar]', 'expect', False,
+         lambda data: exp_count_victims_cheaters(data['dataset'], data['index'],
+                                                 reps=reps, seed=0)),
+        ('exp_count_observers_cheaters[dict]', 'expect', True,
+         lambda data: exp_count_observers_cheaters(data['kills'], data['cheaters'],
+                                                   randomise_player_ids, reps)),
+        ('exp_count_observers_cheaters[columnar]', 'expect', False,
+         lambda data: exp_count_observers_cheaters(data['dataset'], data['index'],
+                                                   reps=reps, seed=0)),
+        ('exp_count_contagion[columnar]', 'expect', False,
+         lambda data: exp_count_contagion(data['dataset'], data['index'], reps=reps, seed=0)),
+    ]
+
+def synthetic_paths(data_dir: str, n_matches: int) -> dict:
+    '''Takes a data directory (data_dir) and a number of matches (n_matches).
+       Generates the synthetic files unless they already exist.
+       Returns a dict with the paths and row counts of generate_data().
+    '''
+    directory = os.path.join(data_dir, f'matches-{n_matches}')
+    info_path = os.path.join(directory, 'info.json')
+
+    if not os.path.exists(info_path):
+        info = generate_data(directory, n_matches)
+        with open(info_path, 'w') as file:
+            json.dump(info, file)
+
+    with open(info_path, 'r') as file:
+        return json.load(file)
+
+def run_benchmarks(sizes: list, data_dir: str, reps: int, dict_limit: int,
+                   only: list = None, memory: bool = True) -> list:
+    '''Takes the numbers of matches (sizes), a data directory (data_dir), the
+           number of repetitions (reps), the largest number of matches for
+           dict-based functions (dict_limit), name filters (only) and bool
+           (memory) whether to measure peak memory.
+       Runs every benchmark at every size.
+       Returns a list of result dicts, one per benchmark and size.
+    '''
+    results = []
+
+    for n_matches in sizes:
+        info = synthetic_paths(data_dir, n_matches)
+        use_dicts = n_matches <= dict_limit
+        print(f'--- {n_matches} matches: {info["rows"]} ---')
+
+        data = {'dataset': ingest(info['paths']['team_ids'], info['paths']['kills'])[0],
+                'index': load_cheater_index(info['paths']['cheaters'])}
+        if use_dicts:
+            data.update({'teams': load_teams(info['paths']['team_ids']),
+                         'kills': load_kills(info['paths']['kills']),
+                         'cheaters': load_cheaters(info['paths']['cheaters'])})
+
+        for name, stage, dict_based, function in benchmarks(info['paths'], reps):
+            if only and not any(part in name for part in only):
+                continue
+
+            result = {'name': name, 'stage': stage, 'matches': n_matches,
+                      'teams_rows': info['rows']['team_ids'],
+                      'kills_rows': info['rows']['kills'],
+                      'reps': reps if stage == 'expect' else None}
+            if dict_based and not use_dicts:
+                result['status'] = 'skipped'
+            else:
+                result.update(measure(lambda: function(data), memory))
+                result['status'] = 'ok'
+
+            results.append(result)
+            print(f'\t{name}: {result.get("wall_s", float("nan")):.3f}s, '
+                  f'peak {result.get("peak_mb") or float("nan"):.1f} MB')
+
+        del data
+
+    return results
+
+# -----------------------------------------------------------------------------
+# 3. Results
+# Runs are compared benchmark by benchmark, on wall time and peak memory
+# -----------------------------------------------------------------------------
+
+def compare(path: str, report: dict, tolerance: float = 0.2) -> list:
+    '''Takes the path of an earlier report (path), the current report
+           (report) and the relative change treated as noise (tolerance).
+           Changes below 10 ms or 1 MB are noise as well.
+       Prints every benchmark that became slower or needs more memory.
+       Returns a list of (name, matches, metric, old, new) regressions.
+    '''
+    with open(path, 'r') as file:
+        old = {(result['name'], result['matches']): result
+               for result in json.load(file)['results'] if result['status'] == 'ok'}
+
+    floors = {'wall_s': 0.01, 'peak_mb': 1}
+    regressions = []
+    for result in report['results']:
+        before = old.get((result['name'], result['matches']))
+        if before is None or result['status'] != 'ok':
+            continue
+        for metric, floor in floors.items():
+            if before[metric] is None or result[metric] is None:
+                continue
+            if result[metric] > max(before[metric] * (1 + tolerance), before[metric] + floor):
+                regressions.append((result['name'], result['matches'], metric,
+                                    before[metric], result[metric]))
+
+    print(f'--- Regressions against {path}: {len(regressions)} ---')
+    for name, n_matches, metric, before, after in regressions:
+        print(f'\t{name} ({n_matches} matches) {metric}: {before:.3f} -> {after:.3f}')
+
+    return regressions
+
+if __name__ == '__main__':
+    main()
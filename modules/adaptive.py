@@ -0,0 +1,105 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing functions for adaptive, sequential Monte Carlo
+# 1. Online mean and variance
+# 2. Adaptive runner
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import numpy as np
+from modules.parallel import run_reps, master_seed
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. Online mean and variance
+# Welford's algorithm; works element-wise for vector statistics
+# -----------------------------------------------------------------------------
+
+def welford_update(state: tuple, values: np.ndarray) -> tuple:
+    '''Takes the running state (state) as (n, mean, m2) and new results 
+           (values), one row per repetition.
+       Folds the values into the running mean and sum of squared deviations.
+       Returns the new state.
+    '''
+    n, mean, m2 = state
+    for value in np.asarray(values, dtype=float):
+        n += 1
+        delta = value - mean
+        mean = mean + delta / n
+        m2 = m2 + delta * (value - mean)
+        
+    return n, mean, m2
+
+def half_width(state: tuple, z_value: float = 1.96):
+    '''Takes the running state (state) and a z-value (z_value).
+       Returns the current CI half-width, z * sd / sqrt(n), as in the 
+           exp_count_* functions.
+    '''
+    n, _, m2 = state
+    return z_value * np.sqrt(m2 / n) / np.sqrt(n)
+
+# -----------------------------------------------------------------------------
+# 2. Adaptive runner
+# Runs batches of repetitions until the CI is narrow enough
+# -----------------------------------------------------------------------------
+
+MAX_REPS = 10000 # Default budget of repetitions
+
+def run_adaptive(statistic, target_half_width: float = None, 
+                 rel_precision: float = None, max_reps: int = MAX_REPS, 
+                 batch_size: int = 50, z_value: float = 1.96, 
+                 seed: int = None, workers: int = 1) -> tuple:
+    '''Takes a function (statistic) as for run_reps(), a target CI half-width
+           (target_half_width) and/or a target half-width relative to the mean
+           (rel_precision), the maximum number of repetitions (max_reps), the
+           repetitions per batch (batch_size), a z-value (z_value), a master 
+           seed (seed) and the number of processes (workers).
+       Runs batches of repetitions and stops once every element of the 
+           statistic meets the target, or when max_reps is reached.
+       Returns the mean, the standard deviation, the number of repetitions 
+           used and bool whether the target was met.
+    '''
+    if target_half_width is None and rel_precision is None:
+        raise ValueError('Either target_half_width or rel_precision is required')
+    
+    seed = master_seed(seed)
+    chunk_size = max(1, -(-batch_size // workers))
+    state = (0, 0.0, 0.0)
+    converged = False
+    
+    while state[0] < max_reps:
+        values = run_reps(statistic, min(batch_size, max_reps - state[0]), seed, 
+                          workers, chunk_size, start=state[0])
+        state = welford_update(state, values)
+        
+        if state[0] < 2:
+            continue
+        current = half_width(state, z_value)
+        if target_half_width is not None and np.all(current <= target_half_width):
+            converged = True
+            break
+        if rel_precision is not None and \
+            np.all(current <= rel_precision * np.abs(state[1])):
+            converged = True
+            break
+        
+    n, mean, m2 = state
+    return mean, np.sqrt(m2 / n), n, converged
+
+def print_adaptive(reps: int, converged: bool):
+    '''Takes the number of repetitions used (reps) and bool (converged) 
+           whether the target was met, as returned by run_adaptive().
+       Pretty-prints the output for users, with a warning if the target was
+           not met.
+    '''
+    print(f'--- Repetitions used: {reps} ---')
+    if not converged:
+        print(f'--- Warning: target precision not reached after {reps} repetitions; '
+              f'the CI is wider than requested ---')
+
+if __name__ == '__name__':
+    main()
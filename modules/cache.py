@@ -0,0 +1,170 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing functions to cache parsed data on disk
+# 1. Fingerprints of source files
+# 2. Array cache
+# 3. Cached loaders
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import numpy as np
+from modules.loading import load_cheaters
+from modules.dataset import ColumnarDataset, CheaterIndex, to_epoch_us, EPOCH, ONE_US
+from modules.ingest import ingest, load_cheater_index
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. Fingerprints of source files
+# A cache entry is fresh while size and mtime match. If only the mtime
+# differs, the content hash decides.
+# -----------------------------------------------------------------------------
+
+def content_hash(path: str, block_size: int = 1 << 20) -> str:
+    '''Takes a path (path) and a read size in bytes (block_size).
+       Returns the BLAKE2b hash of the file's content as hex string.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def file_fingerprint(path: str) -> dict:
+    '''Takes a path (path).
+       Returns a dict with the file's size, mtime and content hash.
+    '''
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'hash': content_hash(path)}
+
+def is_fresh(fingerprint: dict, path: str) -> bool:
+    '''Takes a stored fingerprint (fingerprint) and a path (path).
+       Updates the stored mtime if only the mtime has changed.
+       Returns bool whether the file still matches the fingerprint.
+    '''
+    stat = os.stat(path)
+    if stat.st_size != fingerprint['size']:
+        return False
+
+    if stat.st_mtime_ns != fingerprint['mtime_ns']:
+        if content_hash(path) != fingerprint['hash']:
+            return False
+        fingerprint['mtime_ns'] = stat.st_mtime_ns
+
+    return True
+
+# -----------------------------------------------------------------------------
+# 2. Array cache
+# Format: {cache_dir}/{name}-{key}/manifest.json plus one .npy per array
+# -----------------------------------------------------------------------------
+
+def default_cache_dir(path: str) -> str:
+    '''Takes a source path (path).
+       Returns the .cache directory next to it.
+    '''
+    return os.path.join(os.path.dirname(os.path.abspath(path)), '.cache')
+
+def cached_arrays(name: str, paths: list, build, cache_dir: str = None) -> dict:
+    '''Takes a name (name), a list of source paths (paths), a function
+           (build) returning a dict of arrays parsed from them, and a cache
+           directory (cache_dir).
+       Loads the arrays from the cache with mmap_mode if every source file is
+           fresh, otherwise calls build and rewrites the cache.
+       Returns a dict of read-only, memory-mapped arrays.
+    '''
+    paths = [os.path.abspath(path) for path in paths]
+    key = hashlib.blake2b('\0'.join(paths).encode(), digest_size=8).hexdigest()
+    directory = os.path.join(cache_dir or default_cache_dir(paths[0]), f'{name}-{key}')
+    manifest_path = os.path.join(directory, 'manifest.json')
+
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as file:
+            manifest = json.load(file)
+
+        if all(is_fresh(fingerprint, path)
+               for fingerprint, path in zip(manifest['sources'], paths)):
+            _write_manifest(manifest_path, manifest) # Keeps updated mtimes
+        else:
+            manifest = None
+
+    if manifest is None:
+        os.makedirs(directory, exist_ok=True)
+        fingerprints = [file_fingerprint(path) for path in paths]
+        arrays = build()
+        for array_name, array in arrays.items():
+            np.save(os.path.join(directory, f'{array_name}.tmp.npy'), array)
+            os.replace(os.path.join(directory, f'{array_name}.tmp.npy'),
+                       os.path.join(directory, f'{array_name}.npy'))
+        manifest = {'sources': fingerprints, 'arrays': list(arrays)}
+        _write_manifest(manifest_path, manifest)
+
+    return {array_name: np.load(os.path.join(directory, f'{array_name}.npy'),
+                                mmap_mode='r')
+            for array_name in manifest['arrays']}
+
+def _write_manifest(path: str, manifest: dict):
+    '''Takes a path (path) and a manifest (manifest).
+       Writes the manifest atomically.
+    '''
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.replace(path + '.tmp', path)
+
+# -----------------------------------------------------------------------------
+# 3. Cached loaders
+# -----------------------------------------------------------------------------
+
+def load_dataset_cached(teams_path: str, kills_path: str,
+                        cache_dir: str = None) -> ColumnarDataset:
+    '''Takes paths to the team_ids.txt (teams_path) and kills.txt (kills_path)
+           files and a cache directory (cache_dir).
+       Parses the files with ingest() on a cold start only.
+       Returns a ColumnarDataset backed by memory-mapped arrays.
+    '''
+    build = lambda: vars(ingest(teams_path, kills_path)[0])
+    return ColumnarDataset(**cached_arrays('dataset', [teams_path, kills_path],
+                                           build, cache_dir))
+
+def load_cheaters_cached(path: str, cache_dir: str = None) -> dict:
+    '''Takes path as string and a cache directory (cache_dir).
+       Parses the cheaters.txt file with load_cheaters() on a cold start only.
+       Returns the dict of load_cheaters():
+           {cheater_id}: [start_date, banned_date]
+    '''
+    def build() -> dict:
+        dict_cheaters = load_cheaters(path)
+        return {'cheater_ids': np.array(list(dict_cheaters), dtype=str),
+                'start': np.array([to_epoch_us(dates[0]) for dates in dict_cheaters.values()],
+                                  dtype=np.int64),
+                'banned': np.array([to_epoch_us(dates[1]) for dates in dict_cheaters.values()],
+                                   dtype=np.int64)}
+
+    arrays = cached_arrays('cheaters', [path], build, cache_dir)
+    return {str(cheater): [EPOCH + int(start) * ONE_US, EPOCH + int(banned) * ONE_US]
+            for cheater, start, banned
+            in zip(arrays['cheater_ids'], arrays['start'], arrays['banned'])}
+
+def load_cheater_index_cached(path: str, cache_dir: str = None) -> CheaterIndex:
+    '''Takes path as string and a cache directory (cache_dir).
+       Parses the cheaters.txt file with load_cheater_index() on a cold 
+           start only.
+       Returns a CheaterIndex backed by memory-mapped arrays.
+    '''
+    def build() -> dict:
+        index = load_cheater_index(path)
+        return {'cheater_ids': index.cheater_ids, 'start': index.start, 
+                'banned': index.banned}
+
+    return CheaterIndex(**cached_arrays('cheater-index', [path], build, cache_dir))
+
+if __name__ == '__name__':
+    main()
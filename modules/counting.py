@@ -5,13 +5,20 @@
 # 1. Counting cheaters per team
 # 2. Counting victims becoming cheaters
 # 3. Counting observers becoming cheaters
+# 4. Fused counting of victims and observers
+# 5. Threshold sweep for observers
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 
 import numpy as np
 from datetime import datetime
-from modules.randomisation import randomise_team_ids, randomise_player_ids
+from modules.randomisation import randomise_team_ids, randomise_player_ids, \
+    randomise_player_codes, team_permutations, player_permutation_index
+from modules.dataset import ColumnarDataset, build_dataset, cheater_arrays
+from modules.parallel import run_reps, task_size
+from modules.adaptive import run_adaptive, print_adaptive, MAX_REPS
+from modules.kernels import running_kill_counts, observed_kills
 
 def main():
     pass
@@ -30,9 +37,12 @@ def count_cheaters(team_ids: dict, dict_cheaters: dict) -> dict:
     '''Takes a dict with team_ids (team_ids) and a dict with cheaters 
            (dict_cheaters).
        Counts cheaters within a match per team.
+       A ColumnarDataset is counted by count_cheaters_columnar().
        Returns a dict of len 4, with the overall counts of cheaters per team 
            size.
     '''
+    if isinstance(team_ids, ColumnarDataset):
+        return count_cheaters_columnar(team_ids, dict_cheaters)
     
     # Initialise counts
     counts = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0}
@@ -49,10 +59,76 @@ def count_cheaters(team_ids: dict, dict_cheaters: dict) -> dict:
     
         # Assign to counters
         for num_cheater in helper_dict.values():
-            counts[num_cheater] += 1
+            counts[num_cheater] = counts.get(num_cheater, 0) + 1
     
     return counts
 
+def count_cheaters_columnar(dataset: ColumnarDataset, dict_cheaters: dict) -> dict:
+    '''Takes a ColumnarDataset (dataset) and a dict with cheaters 
+           (dict_cheaters).
+       Counts cheaters per (match, team) with np.bincount.
+       Returns a dict with the overall counts of teams per number of 
+           cheaters, with keys 0-4 and any larger count that occurs.
+    '''
+    is_cheater, _ = cheater_arrays(dataset, dict_cheaters)
+    
+    team_index = _team_index(dataset)
+    cheaters_per_team = np.bincount(team_index, 
+                                    weights=is_cheater[dataset.team_players])
+    
+    histogram = np.bincount(cheaters_per_team.astype(np.int64), minlength=5)
+    return {num_cheater: int(count) for num_cheater, count in enumerate(histogram)}
+
+def _team_index(dataset: ColumnarDataset) -> np.ndarray:
+    '''Takes a ColumnarDataset (dataset).
+       Returns a dense index of the (match, team) pair of each membership row.
+    '''
+    keys = dataset.team_match_index().astype(np.int64) * len(dataset.team_ids) \
+        + dataset.team_codes
+    _, team_index = np.unique(keys, return_inverse=True)
+    return team_index.ravel()
+
+# -----------------------------------------------------------------------------
+# Counts the number of cheaters per team size for many shuffled worlds at once
+# Returns: array of counts, one row per repetition
+# -----------------------------------------------------------------------------
+def team_count_index(dataset: ColumnarDataset, dict_cheaters: dict) -> tuple:
+    '''Takes a ColumnarDataset (dataset) and a dict with cheaters 
+           (dict_cheaters).
+       Returns the dense (match, team) index of each membership row, the 
+           number of teams, the width of the histogram (largest team size 
+           + 1, at least 5) and the membership rows of cheaters.
+    '''
+    is_cheater, _ = cheater_arrays(dataset, dict_cheaters)
+    team_index = _team_index(dataset)
+    n_teams = team_index.max() + 1 if len(team_index) else 0
+    width = max(5, np.bincount(team_index).max() + 1 if n_teams else 0)
+    
+    return team_index, n_teams, width, np.flatnonzero(is_cheater[dataset.team_players])
+
+def count_cheaters_batched(dataset: ColumnarDataset, dict_cheaters: dict,
+                           permutations: np.ndarray, index: tuple = None) -> np.ndarray:
+    '''Takes a ColumnarDataset (dataset), a dict with cheaters (dict_cheaters),
+           permutation index arrays (permutations), as returned by 
+           team_permutations(), and optionally the output of 
+           team_count_index() (index).
+       Counts cheaters per (match, team) in every shuffled world with a 
+           single np.bincount.
+       Returns an int array of shape (reps, largest team size + 1); entry 
+           [r, k] counts the teams with k cheaters in world r.
+    '''
+    team_index, n_teams, width, cheater_rows = index or team_count_index(dataset, 
+                                                                         dict_cheaters)
+    reps = len(permutations)
+    
+    # Shuffling team codes moves every player to the team of row perm[r, i];
+    # only the rows of cheaters add to a team's count
+    keys = np.arange(reps)[:, None] * n_teams + team_index[permutations[:, cheater_rows]]
+    cheaters_per_team = np.bincount(keys.ravel(), minlength=reps * n_teams)
+    
+    keys = np.arange(reps)[:, None] * width + cheaters_per_team.reshape(reps, n_teams)
+    return np.bincount(keys.ravel(), minlength=reps * width).reshape(reps, width)
+
 # -----------------------------------------------------------------------------
 # Wrapper for counting cheaters per team
 # Runs count_cheaters() and "pretty-prints" output
@@ -79,39 +155,250 @@ def count_cheaters_out(team_ids: dict, dict_cheaters: dict) -> dict:
 # ----------------------------------------------------------------------------- 
 
 def exp_count_cheaters(team_ids: dict, dict_cheaters: dict, 
-                       randomiser = randomise_team_ids, reps: int = 20, 
-                       z_value: float = 1.96):
+                       randomiser = None, reps: int = 20, 
+                       z_value: float = 1.96, workers: int = 1, seed: int = None,
+                       target_half_width: float = None, rel_precision: float = None,
+                       max_reps: int = MAX_REPS, exact: bool = False):
     '''Takes two dict with teams data (team_ids) and cheater data 
            (dict_cheaters).
        Takes a function (randomiser), the number of repetitions (reps), and a 
        z-value (z_value).
-       Uses a function (randomiser) to randomly shuffle team IDs reps times.
+       Uses a function (randomiser), by default randomise_team_ids(), to 
+           randomly shuffle team IDs reps times.
+       If exact is True, the expectation is computed in closed form by 
+           exp_count_cheaters_exact() instead, whose CI has zero width.
+       A ColumnarDataset without a randomiser, or any call with a 
+           number of processes (workers) > 1, a master seed (seed) or an 
+           adaptive target (target_half_width, rel_precision), is passed on to
+           exp_count_cheaters_batched().
        Calculates the expected mean and confidence interval with given z_value.
        Returns and prints expected mean and CI for each team size.
     '''
+    if exact:
+        return exp_count_cheaters_exact(team_ids, dict_cheaters, z_value)
+    
+    if (isinstance(team_ids, ColumnarDataset) and randomiser is None) \
+        or workers > 1 or seed is not None \
+        or target_half_width is not None or rel_precision is not None:
+        return exp_count_cheaters_batched(team_ids, dict_cheaters, reps=reps, 
+                                          z_value=z_value, workers=workers, 
+                                          seed=seed, 
+                                          target_half_width=target_half_width,
+                                          rel_precision=rel_precision, 
+                                          max_reps=max_reps)
+    
+    randomiser = randomiser or randomise_team_ids
     outputs = []
     for _ in range(reps):
         outputs.append(count_cheaters(randomiser(team_ids), dict_cheaters))
         
-    final_counts = {0: [], 1: [], 2: [], 3: [], 4: []}
-    for counter in outputs:
-        for count, count_num in counter.items():
-            final_counts[count].append(count_num)
+    final_counts = {count: [counter.get(count, 0) for counter in outputs]
+                    for count in sorted(set(range(5)).union(*outputs))}
                 
     expected_meand_sd = {count: [np.mean(count_num), 
                                  np.mean(count_num) - z_value * np.std(count_num) / np.sqrt(reps),
                                  np.mean(count_num) + z_value * np.std(count_num) / np.sqrt(reps)]
                          for count, count_num in final_counts.items()}
 
+    print_exp_count_cheaters(expected_meand_sd)
+        
+    return expected_meand_sd
+
+def print_exp_count_cheaters(expected_meand_sd: dict):
+    '''Takes a dict of expected mean and CI per number of cheaters 
+           (expected_meand_sd).
+       Pretty-prints the output for users.
+    '''
     print('--- Expected number of cheaters per team ---')
     print('--------------------------------------------')
     for count, (mean, lower, upper) in expected_meand_sd.items():
         print(f'--- Number of cheaters: {count} ---')
         print(f'\tExpected mean: {mean}')
         print(f'\t95% confidence interval: [{lower:.2f},  {upper:.2f}]\n')
+
+# -----------------------------------------------------------------------------
+# Expected counts of cheaters per team, batched engine
+# Shuffles team codes as permutation index arrays, many repetitions at once
+# -----------------------------------------------------------------------------
+
+def exp_count_cheaters_batched(team_ids, dict_cheaters: dict, reps: int = 1000,
+                               z_value: float = 1.96, batch_size: int = 100,
+                               workers: int = 1, seed: int = None,
+                               target_half_width: float = None, 
+                               rel_precision: float = None, 
+                               max_reps: int = MAX_REPS) -> dict:
+    '''Takes teams data (team_ids), as dict or ColumnarDataset, and a dict 
+           with cheaters (dict_cheaters).
+       Takes the number of repetitions (reps), a z-value (z_value), the 
+           largest number of repetitions per task (batch_size), the number of
+           processes (workers) and a master seed (seed).
+       Shuffles team codes within each match without copying the data and 
+           counts the worlds of a task with count_cheaters_batched(), as many
+           at once as team_count_statistic() fits in its memory budget. 
+           Tasks are run by run_reps().
+       With a target CI half-width (target_half_width) or relative precision
+           (rel_precision), batches are run by run_adaptive() until the target
+           is met, up to max_reps repetitions; reps is then not used.
+       Calculates the expected mean and confidence interval with given z_value.
+       Returns and prints expected mean and CI for each number of cheaters.
+    '''
+    dataset = team_ids if isinstance(team_ids, ColumnarDataset) \
+        else build_dataset(dict_teams=team_ids)
+    statistic = team_count_statistic(dataset, dict_cheaters)
+    
+    if target_half_width is not None or rel_precision is not None:
+        mean, sd, reps, converged = run_adaptive(statistic, target_half_width, rel_precision, 
+                                                 max_reps, batch_size, z_value, seed, workers)
+        print_adaptive(reps, converged)
+    else:
+        counts = run_reps(statistic, reps, seed, workers, 
+                          chunk_size=task_size(reps, workers, batch_size))
+        mean, sd = counts.mean(axis=0), counts.std(axis=0)
+    
+    expected_meand_sd = {count: [mean[count],
+                                 mean[count] - z_value * sd[count] / np.sqrt(reps),
+                                 mean[count] + z_value * sd[count] / np.sqrt(reps)]
+                         for count in range(len(mean))}
+    
+    print_exp_count_cheaters(expected_meand_sd)
+    
+    return expected_meand_sd
+
+def team_count_statistic(dataset: ColumnarDataset, dict_cheaters: dict,
+                         batch_bytes: int = 64 << 20):
+    '''Takes a ColumnarDataset (dataset), a dict with cheaters 
+           (dict_cheaters) and the memory for the permutations counted at once
+           (batch_bytes).
+       Counts as many repetitions at once as fit in batch_bytes, at least 
+           one, so memory does not grow with the number of repetitions.
+       Returns a function for run_reps(), mapping a list of generators to one 
+           row of count_cheaters_batched() per generator.
+    '''
+    index = team_count_index(dataset, dict_cheaters)
+    # About 16 bytes per membership row and repetition: the permutation and 
+    # the per-team counts
+    step = max(1, batch_bytes // (16 * max(len(dataset.team_players), 1)))
+    
+    def statistic(rngs: list) -> np.ndarray:
+        counts = []
+        for i in range(0, len(rngs), step):
+            batch = rngs[i:i + step]
+            permutations = np.empty((len(batch), len(dataset.team_players)), dtype=np.intp)
+            for rep, rng in enumerate(batch):
+                permutations[rep] = team_permutations(dataset, 1, rng)[0]
+            counts.append(count_cheaters_batched(dataset, dict_cheaters, permutations, index))
+        
+        return np.concatenate(counts) if counts else np.empty((0, index[2]), dtype=np.int64)
+    
+    return statistic
+
+# -----------------------------------------------------------------------------
+# Exact expected counts of cheaters per team
+# Shuffling team IDs within a match deals the match's cheaters out to its 
+# teams at random, so the numbers of cheaters per team follow a multivariate
+# hypergeometric distribution. Its moments give the expectation exactly.
+# -----------------------------------------------------------------------------
+
+def exact_team_moments(team_ids, dict_cheaters: dict) -> tuple:
+    '''Takes teams data (team_ids), as dict or ColumnarDataset, and a dict 
+           with cheaters (dict_cheaters).
+       Computes, over all matches at once, the mean and variance of the 
+           number of teams with k cheaters under the team-shuffle null model.
+       Returns two float arrays indexed by k, from 0 to the largest team size
+           (at least 4).
+    '''
+    dataset = team_ids if isinstance(team_ids, ColumnarDataset) \
+        else build_dataset(dict_teams=team_ids)
+    is_cheater, _ = cheater_arrays(dataset, dict_cheaters)
+    
+    # Per team: its size, and the players and cheaters of its match
+    team_index = _team_index(dataset)
+    n_teams = team_index.max() + 1 if len(team_index) else 0
+    sizes = np.bincount(team_index, minlength=n_teams)
+    team_match = np.zeros(n_teams, dtype=np.int64)
+    team_match[team_index] = dataset.team_match_index()
+    players = np.diff(dataset.team_offsets)[team_match]
+    cheaters = np.bincount(dataset.team_match_index(), 
+                           weights=is_cheater[dataset.team_players],
+                           minlength=dataset.n_matches).astype(np.int64)[team_match]
+    
+    k = np.arange(max(5, sizes.max() + 1 if n_teams else 0))
+    log_fact = np.concatenate([[0.0], np.cumsum(np.log(np.arange(1, players.max() + 1 if n_teams else 1)))])
+    
+    def log_comb(n, r):
+        '''Returns log(n choose r), and -inf where r is out of range.'''
+        valid = (r >= 0) & (r <= n)
+        n, r = np.where(valid, n, 0), np.where(valid, r, 0)
+        return np.where(valid, log_fact[n] - log_fact[r] - log_fact[n - r], -np.inf)
+    
+    # P(team has k cheaters) = C(s, k) C(N - s, C - k) / C(N, C)
+    s, N, C = sizes[:, None], players[:, None], cheaters[:, None]
+    log_total = log_comb(N, C)
+    p = np.exp(log_comb(s, k) + log_comb(N - s, C - k) - log_total)
+    
+    mean = p.sum(axis=0)
+    var = (p * (1 - p)).sum(axis=0)
+    
+    # Covariance of two teams of the same match:
+    # P(both have k cheaters) = C(s, k) C(s', k) C(N - s - s', C - 2k) / C(N, C)
+    starts = np.r_[0, np.flatnonzero(np.diff(team_match)) + 1]
+    teams_per_match = np.diff(np.r_[starts, n_teams])
+    for g in np.unique(teams_per_match[teams_per_match > 1]):
+        first, second = np.triu_indices(g, 1)
+        match_teams = starts[teams_per_match == g][:, None]
+        t, u = (match_teams + first).ravel(), (match_teams + second).ravel()
+        
+        joint = np.exp(log_comb(s[t], k) + log_comb(s[u], k) 
+                       + log_comb(N[t] - s[t] - s[u], C[t] - 2 * k) - log_total[t])
+        var += 2 * (joint - p[t] * p[u]).sum(axis=0)
         
+    return mean, var
+
+def exp_count_cheaters_exact(team_ids, dict_cheaters: dict, 
+                             z_value: float = 1.96) -> dict:
+    '''Takes teams data (team_ids), as dict or ColumnarDataset, a dict with 
+           cheaters (dict_cheaters) and a z-value (z_value).
+       Computes the expected counts of cheaters per team exactly with 
+           exact_team_moments(), without Monte Carlo noise, so the CI of the
+           mean has zero width. Also prints the spread of the counts under 
+           the null model, from null_range().
+       Returns and prints expected mean and CI for each number of cheaters, 
+           as exp_count_cheaters(), with lower == upper == mean.
+    '''
+    mean, var = exact_team_moments(team_ids, dict_cheaters)
+    
+    expected_meand_sd = {count: [mean[count], mean[count], mean[count]]
+                         for count in range(len(mean))}
+    
+    print_exp_count_cheaters(expected_meand_sd)
+    print_null_range(null_range(mean, var, z_value), z_value)
+    
     return expected_meand_sd
 
+def null_range(mean: np.ndarray, var: np.ndarray, z_value: float = 1.96) -> dict:
+    '''Takes the output of exact_team_moments() (mean, var) and a z-value 
+           (z_value).
+       The range mean +/- z_value * sd describes how much the counts 
+           themselves vary under the null model, not the uncertainty of the 
+           mean.
+       Returns a dict with the null sd and range for each number of 
+           cheaters: {count}: [sd, lower, upper]
+    '''
+    sd = np.sqrt(np.maximum(var, 0))
+    return {count: [sd[count], mean[count] - z_value * sd[count], 
+                    mean[count] + z_value * sd[count]]
+            for count in range(len(mean))}
+
+def print_null_range(ranges: dict, z_value: float = 1.96):
+    '''Takes the output of null_range() (ranges) and its z-value (z_value).
+       Pretty-prints the output for users.
+    '''
+    print('--- Spread of the number of cheaters per team under the null ---')
+    print('----------------------------------------------------------------')
+    for count, (sd, lower, upper) in ranges.items():
+        print(f'--- Number of cheaters: {count} ---')
+        print(f'\tNull distribution sd: {sd:.2f}')
+        print(f'\tNull range (mean +/- {z_value} sd): [{lower:.2f},  {upper:.2f}]\n')
 
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
@@ -119,12 +406,86 @@ def exp_count_cheaters(team_ids: dict, dict_cheaters: dict,
 # -----------------------------------------------------------------------------
 # ----------------------------------------------------------------------------- 
 
+# -----------------------------------------------------------------------------
+# Streams alternative worlds of kills data, one at a time
+# -----------------------------------------------------------------------------
+
+def alternative_worlds(dict_kills: dict, randomiser = randomise_player_ids, 
+                       reps: int = 20):
+    '''Takes a dict with kills data (dict_kills), a function (randomiser) and 
+           the number of repetitions (reps).
+       Yields reps alternative worlds built by alternative_world(). Only one 
+           world is held at a time, so peak memory does not grow with reps.
+    '''
+    for _ in range(reps):
+        yield alternative_world(dict_kills, randomiser)
+
+# -----------------------------------------------------------------------------
+# Counts players in alternative worlds of columnar kills data
+# Returns: one count per repetition
+# -----------------------------------------------------------------------------
+
+def simulate_player_counts(counter, dict_kills, dict_cheaters: dict, 
+                           reps: int = 20, workers: int = 1, 
+                           seed: int = None) -> np.ndarray:
+    '''Takes a counting function (counter), kills data (dict_kills), as dict 
+           or ColumnarDataset, and a dict with cheaters (dict_cheaters).
+       Takes the number of repetitions (reps), the number of processes 
+           (workers) and a master seed (seed).
+       Swaps player codes with randomise_player_codes() in each repetition and
+           counts the players returned by counter. Repetitions are run by 
+           run_reps().
+       Returns an array with one count per repetition.
+    '''
+    return run_reps(player_count_statistic(counter, dict_kills, dict_cheaters), 
+                    reps, seed, workers)
+
+def player_count_statistic(counter, dict_kills, dict_cheaters: dict):
+    '''Takes a counting function (counter), kills data (dict_kills), as dict 
+           or ColumnarDataset, and a dict with cheaters (dict_cheaters).
+       Returns a function for run_reps(), mapping a list of generators to the
+           number of players counted in one alternative world per generator.
+    '''
+    dataset = dict_kills if isinstance(dict_kills, ColumnarDataset) \
+        else build_dataset(dict_kills=dict_kills)
+    index = player_permutation_index(dataset)
+    
+    def statistic(rngs: list) -> list:
+        return [len(counter(randomise_player_codes(dataset, rng, index), dict_cheaters))
+                for rng in rngs]
+    
+    return statistic
+
+# -----------------------------------------------------------------------------
+# Builds one alternative world of kills data
+# Returns: kills data with randomised player IDs
+# -----------------------------------------------------------------------------
+
+def alternative_world(dict_kills: dict, randomiser = randomise_player_ids,
+                      rng: np.random.Generator = None, index: tuple = None):
+    '''Takes a dict with kills data (dict_kills) and a function (randomiser).
+       Uses a function (randomiser) to randomly swap player IDs in each match.
+       A ColumnarDataset is randomised by randomise_player_codes() instead, 
+           with a random generator (rng) and the output of 
+           player_permutation_index() (index).
+       Returns the randomised kills data.
+    '''
+    if isinstance(dict_kills, ColumnarDataset):
+        return randomise_player_codes(dict_kills, rng, index)
+    
+    return {match: [*randomiser(killer, victim), kDate] 
+            for match, (killer, victim, kDate) in dict_kills.items()}
+
+
 def count_victims_cheaters(dict_kills: dict, dict_cheaters: dict) -> dict:
     '''Takes two dict of kill data (dict_kills) and cheater data 
            (dict_cheaters).
        Counts how many victims started cheating based on belows condition.
+       A ColumnarDataset is counted by count_victims_cheaters_columnar().
        Returns a set with those players.
     '''
+    if isinstance(dict_kills, ColumnarDataset):
+        return count_victims_cheaters_columnar(dict_kills, dict_cheaters)
     
     # Conditions
     def cheater_active(player_id: str, date_min: datetime) -> bool:
@@ -153,16 +514,38 @@ def count_victims_cheaters(dict_kills: dict, dict_cheaters: dict) -> dict:
     became_cheater = set()
     
     for match, (killer, victim, kDate) in dict_kills.items():
+        date_min = min(kDate) # Start of the match, computed once
         for kill_index in range(len(killer)): # All same len
         
-            if cheater_active(killer[kill_index], min(kDate)) and  \
-                not cheater_active(victim[kill_index], min(kDate)) and \
+            if cheater_active(killer[kill_index], date_min) and  \
+                not cheater_active(victim[kill_index], date_min) and \
                 later_cheater(victim[kill_index], kDate[kill_index]):
                                          
                     became_cheater.add(victim[kill_index])
 
     return became_cheater
 
+def count_victims_cheaters_columnar(dataset: ColumnarDataset, 
+                                    dict_cheaters: dict) -> set:
+    '''Takes a ColumnarDataset (dataset) and a dict with cheaters 
+           (dict_cheaters).
+       Counts how many victims started cheating, with the same conditions as
+           count_victims_cheaters(), as boolean masks over all kills at once.
+       Returns a set with those players.
+    '''
+    is_cheater, start = cheater_arrays(dataset, dict_cheaters)
+    killers, victims = dataset.killers, dataset.victims
+    date_min = dataset.kill_match_starts()
+    
+    # Conditions, one entry per kill
+    killer_active = is_cheater[killers] & (start[killers] < date_min)
+    victim_active = is_cheater[victims] & (start[victims] < date_min)
+    later_cheater = is_cheater[victims] & (start[victims] > dataset.kill_times)
+    
+    became_cheater = np.unique(victims[killer_active & ~victim_active & later_cheater])
+    
+    return {str(player) for player in dataset.player_ids[became_cheater]}
+
 # -----------------------------------------------------------------------------
 # Wrapper for counting victims who became cheaters
 # Runs count_victims_cheaters() and "pretty-prints" output
@@ -184,28 +567,43 @@ def count_victims_cheaters_out(dict_kills: dict, dict_cheaters: dict) -> dict:
     
 def exp_count_victims_cheaters(dict_kills: dict, dict_cheaters: dict,
                                randomiser = randomise_player_ids, 
-                               reps: int = 20, z_value: float = 1.96) -> list:
+                               reps: int = 20, z_value: float = 1.96,
+                               workers: int = 1, seed: int = None,
+                               target_half_width: float = None, 
+                               rel_precision: float = None, 
+                               max_reps: int = MAX_REPS) -> list:
     '''Takes two dict with kills data (dict_kills) and cheater data 
            (dict_cheaters).
        Takes a function (randomiser), the number of repetitions (reps), and a 
        z-value (z_value).
        Uses a function (randomiser) to randomly swap player IDs reps times.
+       A ColumnarDataset, or any call with a number of processes (workers) 
+           > 1 or a master seed (seed), is counted by simulate_player_counts().
+       With a target CI half-width (target_half_width) or relative precision
+           (rel_precision), repetitions are run by run_adaptive() until the 
+           target is met, up to max_reps repetitions; reps is then not used.
        Calculates the expected mean and confidence interval with given z_value.
        Returns and prints expected mean and CI for victims who became cheaters.
     '''
-    
-    alternative_dicts_kills = [] # List of alternative dict_kills
-
-    for _ in range(reps):
-        alternative_dicts_kills.append({match: [*randomiser(killer, victim), kDate] 
-                                       for match, (killer, victim, kDate) 
-                                       in dict_kills.items()})
+    if target_half_width is not None or rel_precision is not None:
+        statistic = player_count_statistic(count_victims_cheaters, dict_kills, dict_cheaters)
+        mean, sd, reps, converged = run_adaptive(statistic, target_half_width, rel_precision, 
+                                                 max_reps, z_value=z_value, seed=seed, 
+                                                 workers=workers)
+        print_adaptive(reps, converged)
+    else:
+        if isinstance(dict_kills, ColumnarDataset) or workers > 1 or seed is not None:
+            expected_counts = simulate_player_counts(count_victims_cheaters, dict_kills, 
+                                                     dict_cheaters, reps, workers, seed)
+        else:
+            # Each alternative world is counted and discarded before the next
+            expected_counts = [len(count_victims_cheaters(new_world, dict_cheaters)) 
+                               for new_world in alternative_worlds(dict_kills, randomiser, reps)]
+        mean, sd = np.mean(expected_counts), np.std(expected_counts)
         
-    expected_counts = [len(count_victims_cheaters(new_world, dict_cheaters)) 
-                       for new_world in alternative_dicts_kills]
-    expected_counts = [np.mean(expected_counts), 
-                       np.mean(expected_counts) - z_value * np.std(expected_counts) / np.sqrt(reps),
-                       np.mean(expected_counts) + z_value * np.std(expected_counts) / np.sqrt(reps)
+    expected_counts = [mean, 
+                       mean - z_value * sd / np.sqrt(reps),
+                       mean + z_value * sd / np.sqrt(reps)
                        ]
     
     print('--- Expected number of victims becoming cheaters ---')
@@ -229,17 +627,21 @@ def count_observers_cheaters(dict_kills: dict, dict_cheaters: dict) -> dict:
            (dict_cheaters).
        Counts how many observers started cheating based on below defined 
            conditions.
+       A ColumnarDataset is counted by count_observers_cheaters_columnar().
        Returns a set with those players.
     '''
+    if isinstance(dict_kills, ColumnarDataset):
+        return count_observers_cheaters_columnar(dict_kills, dict_cheaters)
     
     observers_cheated = set()
 
     for match, (killer, victim, date) in dict_kills.items():
         
+        date_min = min(date) # Start of the match, computed once
         helper_dict = {}
         for i in range(len(killer)): # All data of the same len
             
-            if killer[i] in dict_cheaters and min(date) > dict_cheaters[killer[i]][0]:
+            if killer[i] in dict_cheaters and date_min > dict_cheaters[killer[i]][0]:
                 
                 helper_dict.setdefault(killer[i], 0)
                 helper_dict[killer[i]] += 1
@@ -247,12 +649,50 @@ def count_observers_cheaters(dict_kills: dict, dict_cheaters: dict) -> dict:
                 if helper_dict[killer[i]] == 3:
                     for observer in victim[date.index(date[i]) + 1:]: # observers
                         if observer in dict_cheaters and not  \
-                            dict_cheaters[observer][0] < min(date):
+                            dict_cheaters[observer][0] < date_min:
                             observers_cheated.add(observer)
                     continue
             
     return observers_cheated
 
+def count_observers_cheaters_columnar(dataset: ColumnarDataset, 
+                                      dict_cheaters: dict) -> set:
+    '''Takes a ColumnarDataset (dataset) and a dict with cheaters 
+           (dict_cheaters).
+       Counts how many observers started cheating, with the same conditions 
+           as count_observers_cheaters(). Finds the 3rd kill of each active 
+           cheater from running kill counts and marks later victims with 
+           offset arithmetic, over all matches at once.
+       Returns a set with those players.
+    '''
+    is_cheater, start = cheater_arrays(dataset, dict_cheaters)
+    killers, victims = dataset.killers, dataset.victims
+    match_index = dataset.kill_match_index()
+    date_min = dataset.kill_match_starts()
+    
+    killer_active = is_cheater[killers] & (date_min > start[killers])
+    observed = observed_kills(dataset, running_kill_counts(dataset, killer_active), 
+                              match_index, first_same_time(dataset) + 1)
+    observer_new = is_cheater[victims] & ~(start[victims] < date_min)
+    
+    observers_cheated = np.unique(victims[observed & observer_new])
+    
+    return {str(player) for player in dataset.player_ids[observers_cheated]}
+
+def first_same_time(dataset: ColumnarDataset) -> np.ndarray:
+    '''Takes a ColumnarDataset (dataset).
+       Finds for each kill the first kill of its match with the same time, 
+           i.e. date.index(date[i]) in count_observers_cheaters().
+       Returns an int64 array of kill indices.
+    '''
+    times, match_index = dataset.kill_times, dataset.kill_match_index()
+    position = np.arange(len(times))
+    
+    new_time = np.ones(len(times), dtype=bool)
+    new_time[1:] = (times[1:] != times[:-1]) | (match_index[1:] != match_index[:-1])
+    
+    return np.maximum.accumulate(np.where(new_time, position, 0))
+
 # -----------------------------------------------------------------------------
 # Wrapper for counting observers who became cheaters
 # Runs count_observers_cheaters() and "pretty-prints" output
@@ -275,29 +715,43 @@ def count_observers_cheaters_out(dict_kills: dict, dict_cheaters: dict) -> dict:
     
 def exp_count_observers_cheaters(dict_kills: dict, dict_cheaters: dict,
                                  randomiser = randomise_player_ids, reps: int = 20, 
-                                 z_value: float = 1.96) -> list:
+                                 z_value: float = 1.96, workers: int = 1,
+                                 seed: int = None, target_half_width: float = None,
+                                 rel_precision: float = None, 
+                                 max_reps: int = MAX_REPS) -> list:
     '''Takes two dict with kills data (dict_kills) and cheater data 
            (dict_cheaters).
        Takes a function (randomiser), the number of repetitions (reps), and a 
        z-value (z_value).
        Uses a function (randomiser) to randomly swap player IDs reps times.
+       A ColumnarDataset, or any call with a number of processes (workers) 
+           > 1 or a master seed (seed), is counted by simulate_player_counts().
+       With a target CI half-width (target_half_width) or relative precision
+           (rel_precision), repetitions are run by run_adaptive() until the 
+           target is met, up to max_reps repetitions; reps is then not used.
        Calculates the expected mean and confidence interval with given z_value.
        Returns and prints expected mean and CI for observers who became 
            cheaters.
     '''
-    
-    # Collect all alternative worlds
-    alternative_dicts_kills = [] 
-    for _ in range(reps):
-        alternative_dicts_kills.append({match: [*randomiser(killer, victim), kDate] 
-                                       for match, (killer, victim, kDate) 
-                                       in dict_kills.items()})
+    if target_half_width is not None or rel_precision is not None:
+        statistic = player_count_statistic(count_observers_cheaters, dict_kills, dict_cheaters)
+        mean, sd, reps, converged = run_adaptive(statistic, target_half_width, rel_precision, 
+                                                 max_reps, z_value=z_value, seed=seed, 
+                                                 workers=workers)
+        print_adaptive(reps, converged)
+    else:
+        if isinstance(dict_kills, ColumnarDataset) or workers > 1 or seed is not None:
+            expected_counts = simulate_player_counts(count_observers_cheaters, dict_kills, 
+                                                     dict_cheaters, reps, workers, seed)
+        else:
+            # Each alternative world is counted and discarded before the next
+            expected_counts = [len(count_observers_cheaters(new_world, dict_cheaters)) 
+                               for new_world in alternative_worlds(dict_kills, randomiser, reps)]
+        mean, sd = np.mean(expected_counts), np.std(expected_counts)
         
-    expected_counts = [len(count_observers_cheaters(new_world, dict_cheaters)) 
-                       for new_world in alternative_dicts_kills]
-    expected_counts = [np.mean(expected_counts), 
-                       np.mean(expected_counts) - z_value * np.std(expected_counts) / np.sqrt(reps),
-                       np.mean(expected_counts) + z_value * np.std(expected_counts) / np.sqrt(reps)
+    expected_counts = [mean, 
+                       mean - z_value * sd / np.sqrt(reps),
+                       mean + z_value * sd / np.sqrt(reps)
                        ]
     
     print('--- Expected number of observers becoming cheaters ---')
@@ -307,6 +761,262 @@ def exp_count_observers_cheaters(dict_kills: dict, dict_cheaters: dict,
     
     return expected_counts
     
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# 4. Fused counting of victims and observers
+# Randomising player IDs only moves killers, so everything that depends on
+# victims and times is computed once per dataset and shared by all worlds
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+def contagion_state(dataset: ColumnarDataset, dict_cheaters: dict) -> dict:
+    '''Takes a ColumnarDataset (dataset) and a dict with cheaters 
+           (dict_cheaters).
+       Computes match start times and the victim-side conditions of both 
+           count_victims_cheaters() and count_observers_cheaters().
+       Returns a dict of arrays, valid for every world of the dataset.
+    '''
+    is_cheater, start = cheater_arrays(dataset, dict_cheaters)
+    victims, times = dataset.victims, dataset.kill_times
+    date_min = dataset.kill_match_starts()
+    victim_active = is_cheater[victims] & (start[victims] < date_min)
+    
+    return {'is_cheater': is_cheater, 
+            'start': start, 
+            'date_min': date_min,
+            'match_index': dataset.kill_match_index(),
+            'window_floor': first_same_time(dataset) + 1,
+            'victim_new': is_cheater[victims] & ~victim_active & (start[victims] > times),
+            'observer_new': is_cheater[victims] & ~victim_active}
+
+def count_contagion(dataset: ColumnarDataset, dict_cheaters: dict,
+                    state: dict = None) -> tuple:
+    '''Takes a ColumnarDataset (dataset), a dict with cheaters (dict_cheaters)
+           and optionally the output of contagion_state() (state).
+       Counts victims and observers who became cheaters in one pass, sharing
+           the cheater status of the killers.
+       Returns two sets with those players: victims and observers.
+    '''
+    state = state or contagion_state(dataset, dict_cheaters)
+    killers, victims = dataset.killers, dataset.victims
+    
+    killer_active = state['is_cheater'][killers] & \
+        (state['start'][killers] < state['date_min'])
+    observed = observed_kills(dataset, running_kill_counts(dataset, killer_active), 
+                              state['match_index'], state['window_floor'])
+    
+    became_cheater = np.unique(victims[killer_active & state['victim_new']])
+    observers_cheated = np.unique(victims[observed & state['observer_new']])
+    
+    return ({str(player) for player in dataset.player_ids[became_cheater]},
+            {str(player) for player in dataset.player_ids[observers_cheated]})
+
+# -----------------------------------------------------------------------------
+# Wrapper for counting victims and observers who became cheaters
+# ----------------------------------------------------------------------------- 
+
+def count_contagion_out(dict_kills, dict_cheaters: dict):
+    '''Wrapper function for count_contagion().
+       Takes kills data (dict_kills), as dict or ColumnarDataset.
+       Pretty-prints the output for users.
+    '''
+    dataset = dict_kills if isinstance(dict_kills, ColumnarDataset) \
+        else build_dataset(dict_kills=dict_kills)
+    became_cheater, observers_cheated = count_contagion(dataset, dict_cheaters)
+    
+    print('--- Victims becoming cheaters ---')
+    print('---------------------------------')
+    print(f'\tNumber of victims becoming cheaters: {len(became_cheater)}')
+    print('\t\t')
+    print('--- Observers becoming cheaters ---')
+    print('-----------------------------------')
+    print(f'\tNumber of observers becoming cheaters: {len(observers_cheated)}')
+    print('\t\t')
+
+# -----------------------------------------------------------------------------
+# Expected counts of victims and observers who became cheaters
+# One randomised world per repetition serves both statistics
+# ----------------------------------------------------------------------------- 
+
+def contagion_statistic(dict_kills, dict_cheaters: dict):
+    '''Takes kills data (dict_kills), as dict or ColumnarDataset, and a dict 
+           with cheaters (dict_cheaters).
+       Returns a function for run_reps(), mapping a list of generators to the
+           numbers of victims and observers who became cheaters in one 
+           alternative world per generator.
+    '''
+    dataset = dict_kills if isinstance(dict_kills, ColumnarDataset) \
+        else build_dataset(dict_kills=dict_kills)
+    index = player_permutation_index(dataset)
+    state = contagion_state(dataset, dict_cheaters)
+    
+    def statistic(rngs: list) -> list:
+        return [[len(players) for players in 
+                 count_contagion(randomise_player_codes(dataset, rng, index), 
+                                 dict_cheaters, state)]
+                for rng in rngs]
+    
+    return statistic
+
+def exp_count_contagion(dict_kills, dict_cheaters: dict, reps: int = 20, 
+                        z_value: float = 1.96, workers: int = 1, 
+                        seed: int = None, target_half_width: float = None, 
+                        rel_precision: float = None, 
+                        max_reps: int = MAX_REPS) -> dict:
+    '''Takes kills data (dict_kills), as dict or ColumnarDataset, and a dict 
+           with cheaters (dict_cheaters).
+       Takes the number of repetitions (reps), a z-value (z_value), the number
+           of processes (workers) and a master seed (seed).
+       Swaps player IDs reps times and counts victims and observers who became
+           cheaters in each alternative world in one pass.
+       With a target CI half-width (target_half_width) or relative precision
+           (rel_precision), repetitions are run by run_adaptive() until both 
+           statistics meet the target, up to max_reps repetitions; reps is 
+           then not used.
+       Calculates the expected mean and confidence interval with given z_value.
+       Returns and prints a dict with expected mean and CI for victims and 
+           observers who became cheaters.
+    '''
+    statistic = contagion_statistic(dict_kills, dict_cheaters)
+    
+    if target_half_width is not None or rel_precision is not None:
+        mean, sd, reps, converged = run_adaptive(statistic, target_half_width, rel_precision, 
+                                                 max_reps, z_value=z_value, seed=seed, 
+                                                 workers=workers)
+        print_adaptive(reps, converged)
+    else:
+        counts = run_reps(statistic, reps, seed, workers)
+        mean, sd = counts.mean(axis=0), counts.std(axis=0)
+    
+    expected_counts = {task: [mean[i], 
+                              mean[i] - z_value * sd[i] / np.sqrt(reps),
+                              mean[i] + z_value * sd[i] / np.sqrt(reps)]
+                       for i, task in enumerate(['victims', 'observers'])}
+    
+    for task, (mean, lower, upper) in expected_counts.items():
+        print(f'--- Expected number of {task} becoming cheaters ---')
+        print('-' * (len(task) + 45))
+        print(f'\tExpected mean: {mean:.2f}')
+        print(f'\t95% confidence interval: [{lower:.2f}, {upper:.2f}]')
+    
+    return expected_counts
+    
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# 5. Threshold sweep for observers
+# count_observers_cheaters() needs a killer's 3rd kill. The sweep varies the
+# number of kills and adds a minimum time gap between that kill and the 
+# observers' deaths. All settings share one pass per world.
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+def kills_after_gap(dataset: ColumnarDataset, gap: int) -> np.ndarray:
+    '''Takes a ColumnarDataset (dataset) and a time gap in microseconds (gap).
+       Finds for each kill the first kill of its match at least gap later, or
+           the end of the match.
+       Returns an int64 array of kill indices.
+    '''
+    times, match_index = dataset.kill_times, dataset.kill_match_index()
+    n_kills = len(times)
+    
+    # Kills are sorted by (match, time). Sorting them together with the 
+    # queries (match, time + gap), queries first on ties, puts each query 
+    # after exactly the kills that come before its answer.
+    order = np.lexsort((np.r_[np.ones(n_kills, dtype=np.int8), np.zeros(n_kills, dtype=np.int8)],
+                        np.r_[times, times + gap], np.r_[match_index, match_index]))
+    is_kill = order < n_kills
+    
+    first_after = np.empty(n_kills, dtype=np.int64)
+    first_after[order[~is_kill] - n_kills] = np.cumsum(is_kill)[~is_kill]
+    
+    return first_after
+
+def sweep_state(dataset: ColumnarDataset, dict_cheaters: dict, 
+                min_gaps: list = (0,)) -> dict:
+    '''Takes a ColumnarDataset (dataset), a dict with cheaters (dict_cheaters)
+           and minimum time gaps in seconds (min_gaps).
+       Extends contagion_state() with the first observing kill of each kill 
+           for every gap.
+       Returns a dict of arrays, valid for every world of the dataset.
+    '''
+    state = contagion_state(dataset, dict_cheaters)
+    # Without a gap, first_same_time() + 1 already bounds the window
+    state['window_floors'] = [np.maximum(state['window_floor'], 
+                                         kills_after_gap(dataset, int(gap * 1e6)))
+                              if gap > 0 else state['window_floor']
+                              for gap in min_gaps]
+    return state
+
+def count_observers_sweep(dataset: ColumnarDataset, dict_cheaters: dict, 
+                          thresholds: list = range(1, 6), min_gaps: list = (0,),
+                          state: dict = None) -> np.ndarray:
+    '''Takes a ColumnarDataset (dataset), a dict with cheaters (dict_cheaters),
+           numbers of kills (thresholds), minimum time gaps in seconds 
+           (min_gaps) and optionally the output of sweep_state() (state).
+       Counts observers who became cheaters for every setting, from one set 
+           of running kill counts.
+       Returns an int array with one count per (threshold, gap) setting, 
+           thresholds varying slowest.
+    '''
+    state = state or sweep_state(dataset, dict_cheaters, min_gaps)
+    killers, victims = dataset.killers, dataset.victims
+    
+    killer_active = state['is_cheater'][killers] & \
+        (state['start'][killers] < state['date_min'])
+    kill_counts = running_kill_counts(dataset, killer_active)
+    
+    return np.array([len(np.unique(victims[observed_kills(dataset, kill_counts, 
+                                                          state['match_index'], 
+                                                          window_floor, threshold)
+                                           & state['observer_new']]))
+                     for threshold in thresholds 
+                     for window_floor in state['window_floors']])
+
+def sweep_observers_cheaters(dict_kills, dict_cheaters: dict, 
+                             thresholds: list = range(1, 6), 
+                             min_gaps: list = (0,), reps: int = 20, 
+                             z_value: float = 1.96, workers: int = 1, 
+                             seed: int = None) -> list:
+    '''Takes kills data (dict_kills), as dict or ColumnarDataset, and a dict 
+           with cheaters (dict_cheaters).
+       Takes numbers of kills (thresholds), minimum time gaps in seconds 
+           (min_gaps), the number of repetitions (reps), a z-value (z_value),
+           the number of processes (workers) and a master seed (seed).
+       Counts observers who became cheaters, and their expected mean and CI,
+           for every setting. Each alternative world is counted once for all
+           settings.
+       Returns and prints a table as list of dicts, one row per setting.
+    '''
+    dataset = dict_kills if isinstance(dict_kills, ColumnarDataset) \
+        else build_dataset(dict_kills=dict_kills)
+    index = player_permutation_index(dataset)
+    state = sweep_state(dataset, dict_cheaters, min_gaps)
+    
+    def statistic(rngs: list) -> list:
+        return [count_observers_sweep(randomise_player_codes(dataset, rng, index), 
+                                      dict_cheaters, thresholds, min_gaps, state)
+                for rng in rngs]
+    
+    observed = count_observers_sweep(dataset, dict_cheaters, thresholds, min_gaps, state)
+    counts = run_reps(statistic, reps, seed, workers)
+    mean, sd = counts.mean(axis=0), counts.std(axis=0)
+    
+    settings = [(threshold, gap) for threshold in thresholds for gap in min_gaps]
+    table = [{'threshold': threshold, 'min_gap': gap, 'observed': int(observed[i]),
+              'expected': mean[i], 
+              'lower': mean[i] - z_value * sd[i] / np.sqrt(reps),
+              'upper': mean[i] + z_value * sd[i] / np.sqrt(reps)}
+             for i, (threshold, gap) in enumerate(settings)]
+    
+    print('--- Observers becoming cheaters per threshold ---')
+    print('-------------------------------------------------')
+    print('\tKills\tMin gap (s)\tObserved\tExpected\t95% confidence interval')
+    for row in table:
+        print(f"\t{row['threshold']}\t{row['min_gap']}\t\t{row['observed']}\t\t"
+              f"{row['expected']:.2f}\t\t[{row['lower']:.2f}, {row['upper']:.2f}]")
+    
+    return table
+    
 if __name__ == '__name__':
     main()
     
@@ -0,0 +1,320 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing the columnar, integer-encoded dataset
+# 1. Time conversion
+# 2. Columnar dataset
+# 3. Build dataset from dicts
+# 4. Load dataset from files
+# 5. Cheater index
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import numpy as np
+from datetime import datetime, timedelta
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. Time conversion
+# Timestamps are stored as int64 microseconds since the epoch
+# -----------------------------------------------------------------------------
+
+EPOCH = datetime(1970, 1, 1)
+ONE_US = timedelta(microseconds=1)
+
+def to_epoch_us(date: datetime) -> int:
+    '''Takes a datetime (date).
+       Returns the number of microseconds since the epoch as int.
+    '''
+    return (date - EPOCH) // ONE_US
+
+# -----------------------------------------------------------------------------
+# 2. Columnar dataset
+# Player, team and match IDs are interned to dense int32 codes. Team
+# memberships and kills are flat arrays, grouped by match with CSR-style
+# offsets: the rows of match m are [offsets[m], offsets[m + 1]).
+# -----------------------------------------------------------------------------
+
+class ColumnarDataset:
+    '''Columnar, integer-encoded teams and kills data.
+       Vocabularies (code -> ID):
+           match_ids, player_ids, team_ids
+       Team memberships, grouped by match:
+           team_offsets, team_players, team_codes
+       Kills, grouped by match and sorted by time within a match:
+           kill_offsets, killers, victims, kill_times
+    '''
+
+    def __init__(self, match_ids, player_ids, team_ids,
+                 team_offsets, team_players, team_codes,
+                 kill_offsets, killers, victims, kill_times):
+        self.match_ids = match_ids
+        self.player_ids = player_ids
+        self.team_ids = team_ids
+
+        self.team_offsets = team_offsets
+        self.team_players = team_players
+        self.team_codes = team_codes
+
+        self.kill_offsets = kill_offsets
+        self.killers = killers
+        self.victims = victims
+        self.kill_times = kill_times
+
+    @property
+    def n_matches(self) -> int:
+        return len(self.match_ids)
+
+    @property
+    def n_players(self) -> int:
+        return len(self.player_ids)
+
+    def replace(self, **arrays) -> 'ColumnarDataset':
+        '''Takes keyword arrays (arrays) named like the dataset's attributes.
+           Returns a shallow copy with those arrays replaced; all other arrays
+               are shared, not copied.
+        '''
+        fields = dict(vars(self))
+        fields.update(arrays)
+        return ColumnarDataset(**fields)
+
+    def team_match_index(self) -> np.ndarray:
+        '''Returns the match code of each team membership row.'''
+        return _match_index(self.team_offsets)
+
+    def kill_match_index(self) -> np.ndarray:
+        '''Returns the match code of each kill row.'''
+        return _match_index(self.kill_offsets)
+
+    def kill_match_starts(self) -> np.ndarray:
+        '''Returns the start time of each kill's match, i.e. the time of the
+               match's first kill.
+        '''
+        counts = np.diff(self.kill_offsets)
+        firsts = self.kill_offsets[:-1][counts > 0]
+        return np.repeat(self.kill_times[firsts], counts[counts > 0])
+
+    def nbytes(self) -> int:
+        '''Returns the number of bytes held by the dataset's arrays.'''
+        return sum(array.nbytes for array in vars(self).values())
+
+
+def _match_index(offsets: np.ndarray) -> np.ndarray:
+    '''Takes CSR-style offsets (offsets).
+       Returns the group code of each row.
+    '''
+    return np.repeat(np.arange(len(offsets) - 1, dtype=np.int32),
+                     np.diff(offsets))
+
+def _group(match_codes: np.ndarray, n_matches: int, order_keys: tuple = ()):
+    '''Takes the match code of each row (match_codes), the number of matches
+           (n_matches) and optional secondary sort keys (order_keys).
+       Sorts rows stably by match (then by order_keys).
+       Returns the row order and the CSR-style offsets.
+    '''
+    order = np.lexsort(tuple(order_keys) + (match_codes,))
+    offsets = np.zeros(n_matches + 1, dtype=np.int64)
+    np.cumsum(np.bincount(match_codes, minlength=n_matches), out=offsets[1:])
+    return order, offsets
+
+def _vocabulary(codes: dict) -> np.ndarray:
+    '''Takes a dict of {ID: code} (codes).
+       Returns an array of IDs indexed by code.
+    '''
+    return np.array(list(codes), dtype=str)
+
+def assemble_dataset(match_ids: np.ndarray, player_ids: np.ndarray, 
+                     team_ids: np.ndarray, team_rows: tuple, 
+                     kill_rows: tuple) -> ColumnarDataset:
+    '''Takes the vocabularies (match_ids, player_ids, team_ids) and the flat,
+           ungrouped, integer-encoded rows of teams (team_rows) as 
+           (match, player, team) and kills (kill_rows) as 
+           (match, killer, victim, time).
+       Groups rows by match, kills additionally by time.
+       Returns a ColumnarDataset.
+    '''
+    n_matches = len(match_ids)
+
+    t_match, t_player, t_team = (np.asarray(col, dtype=np.int32) for col in team_rows)
+    order, team_offsets = _group(t_match, n_matches)
+
+    k_match, k_killer, k_victim = (np.asarray(col, dtype=np.int32) for col in kill_rows[:3])
+    k_time = np.asarray(kill_rows[3], dtype=np.int64)
+    k_order, kill_offsets = _group(k_match, n_matches, (k_time,))
+
+    return ColumnarDataset(match_ids=match_ids,
+                           player_ids=player_ids,
+                           team_ids=team_ids,
+                           team_offsets=team_offsets,
+                           team_players=t_player[order],
+                           team_codes=t_team[order],
+                           kill_offsets=kill_offsets,
+                           killers=k_killer[k_order],
+                           victims=k_victim[k_order],
+                           kill_times=k_time[k_order])
+
+# -----------------------------------------------------------------------------
+# 3. Build dataset from dicts
+# Takes the outputs of load_teams() and load_kills()
+# -----------------------------------------------------------------------------
+
+def build_dataset(dict_teams: dict = None, dict_kills: dict = None) -> ColumnarDataset:
+    '''Takes a dict with teams data (dict_teams) and a dict with kills data
+           (dict_kills), as returned by load_teams() and load_kills().
+       Either may be None.
+       Interns match, player and team IDs to dense codes.
+       Returns a ColumnarDataset.
+    '''
+    match_codes, player_codes, team_codes = {}, {}, {}
+    team_rows = ([], [], [])
+    kill_rows = ([], [], [], [])
+
+    for match, (teams, players) in (dict_teams or {}).items():
+        m = match_codes.setdefault(match, len(match_codes))
+        for team, player in zip(teams, players):
+            team_rows[0].append(m)
+            team_rows[1].append(player_codes.setdefault(player, len(player_codes)))
+            team_rows[2].append(team_codes.setdefault(team, len(team_codes)))
+
+    for match, (killers, victims, dates) in (dict_kills or {}).items():
+        m = match_codes.setdefault(match, len(match_codes))
+        for killer, victim, date in zip(killers, victims, dates):
+            kill_rows[0].append(m)
+            kill_rows[1].append(player_codes.setdefault(killer, len(player_codes)))
+            kill_rows[2].append(player_codes.setdefault(victim, len(player_codes)))
+            kill_rows[3].append(to_epoch_us(date))
+
+    return assemble_dataset(_vocabulary(match_codes), _vocabulary(player_codes),
+                            _vocabulary(team_codes), team_rows, kill_rows)
+
+# -----------------------------------------------------------------------------
+# 4. Load dataset from files
+# Streams team_ids.txt and kills.txt straight into flat arrays
+# -----------------------------------------------------------------------------
+
+def load_dataset(teams_path: str = None, kills_path: str = None) -> ColumnarDataset:
+    '''Takes paths to the team_ids.txt (teams_path) and kills.txt (kills_path)
+           files. Either may be None.
+       Streams both files into flat arrays without building per-match dicts.
+       Kills are sorted by time within a match, like load_kills(sort=True).
+       Returns a ColumnarDataset.
+    '''
+    match_codes, player_codes, team_codes = {}, {}, {}
+    team_rows = ([], [], [])
+    kill_rows = ([], [], [], [])
+
+    if teams_path is not None:
+        for line in open(teams_path, 'r'):
+            match, player, team = line.rstrip().split('\t')
+            team_rows[0].append(match_codes.setdefault(match, len(match_codes)))
+            team_rows[1].append(player_codes.setdefault(player, len(player_codes)))
+            team_rows[2].append(team_codes.setdefault(int(team), len(team_codes)))
+
+    if kills_path is not None:
+        for line in open(kills_path, 'r'):
+            match, killer, victim, date = line.rstrip().split('\t')
+            kill_rows[0].append(match_codes.setdefault(match, len(match_codes)))
+            kill_rows[1].append(player_codes.setdefault(killer, len(player_codes)))
+            kill_rows[2].append(player_codes.setdefault(victim, len(player_codes)))
+            kill_rows[3].append(to_epoch_us(datetime.strptime(date, '%Y-%m-%d %H:%M:%S.%f')))
+
+    return assemble_dataset(_vocabulary(match_codes), _vocabulary(player_codes),
+                            _vocabulary(team_codes), team_rows, kill_rows)
+
+# -----------------------------------------------------------------------------
+# 5. Cheater index
+# Cheater IDs are kept sorted, with parallel int64 start and ban dates, so a
+# whole vocabulary of player IDs is looked up with one np.searchsorted
+# -----------------------------------------------------------------------------
+
+class CheaterIndex:
+    '''Compact, array-backed replacement for the dict of load_cheaters().
+       Sorted, unique cheater IDs with parallel int64 start and ban dates, as
+           microseconds since the epoch:
+           cheater_ids, start, banned
+       Supports "player in index" and index[player], returning
+           [start_date, banned_date] as load_cheaters() does, so it can be 
+           passed wherever a dict with cheaters is expected.
+    '''
+
+    def __init__(self, cheater_ids, start, banned):
+        # The first entry of a cheater wins, as in load_cheaters()
+        cheater_ids, first = np.unique(np.asarray(cheater_ids, dtype=str), 
+                                       return_index=True)
+        self.cheater_ids = cheater_ids
+        self.start = np.asarray(start, dtype=np.int64)[first]
+        self.banned = np.asarray(banned, dtype=np.int64)[first]
+        self._bound = (None, None)
+
+    def __len__(self) -> int:
+        return len(self.cheater_ids)
+
+    def __contains__(self, player) -> bool:
+        return self.positions(np.array([player], dtype=str))[0] >= 0
+
+    def __getitem__(self, player) -> list:
+        position = self.positions(np.array([player], dtype=str))[0]
+        if position < 0:
+            raise KeyError(player)
+        return [EPOCH + int(self.start[position]) * ONE_US,
+                EPOCH + int(self.banned[position]) * ONE_US]
+
+    def positions(self, player_ids: np.ndarray) -> np.ndarray:
+        '''Takes an array of player IDs (player_ids).
+           Returns the position of each player in cheater_ids, or -1 for
+               players who are not cheaters.
+        '''
+        player_ids = np.asarray(player_ids, dtype=str)
+        if not len(self.cheater_ids):
+            return np.full(len(player_ids), -1, dtype=np.int64)
+
+        positions = np.searchsorted(self.cheater_ids, player_ids)
+        positions = np.minimum(positions, len(self.cheater_ids) - 1)
+        return np.where(self.cheater_ids[positions] == player_ids, positions, -1)
+
+    def arrays(self, player_ids: np.ndarray) -> tuple:
+        '''Takes the player vocabulary of a dataset (player_ids).
+           Looks the whole vocabulary up at once. The result for the last 
+               vocabulary is kept, since datasets derived with replace() share
+               it.
+           Returns a bool array marking cheaters and int64 arrays of their 
+               start and ban dates, indexed by player code; dates of other
+               players are 0.
+        '''
+        if self._bound[0] is not player_ids:
+            positions = self.positions(player_ids)
+            is_cheater = positions >= 0
+            start = np.zeros(len(positions), dtype=np.int64)
+            banned = np.zeros(len(positions), dtype=np.int64)
+            start[is_cheater] = self.start[positions[is_cheater]]
+            banned[is_cheater] = self.banned[positions[is_cheater]]
+            self._bound = (player_ids, (is_cheater, start, banned))
+
+        return self._bound[1]
+
+
+def cheater_index(dict_cheaters: dict) -> CheaterIndex:
+    '''Takes a dict with cheaters (dict_cheaters), as returned by 
+           load_cheaters(), or a CheaterIndex.
+       Returns a CheaterIndex.
+    '''
+    if isinstance(dict_cheaters, CheaterIndex):
+        return dict_cheaters
+    return CheaterIndex(list(dict_cheaters),
+                        [to_epoch_us(dates[0]) for dates in dict_cheaters.values()],
+                        [to_epoch_us(dates[1]) for dates in dict_cheaters.values()])
+
+def cheater_arrays(dataset: ColumnarDataset, dict_cheaters):
+    '''Takes a ColumnarDataset (dataset) and cheaters (dict_cheaters), as a
+           dict returned by load_cheaters() or a CheaterIndex.
+       Returns a bool array marking cheaters and an int64 array of their 
+           start dates, both indexed by player code.
+    '''
+    is_cheater, start, _ = cheater_index(dict_cheaters).arrays(dataset.player_ids)
+    return is_cheater, start
+
+if __name__ == '__name__':
+    main()
@@ -0,0 +1,242 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing functions to update counts incrementally as data arrives
+# 1. State
+# 2. Per-match partial results
+# 3. Incremental update
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import json
+import pickle
+import sqlite3
+from collections import Counter
+from datetime import datetime
+from modules.loading import load_teams, load_kills, load_cheaters
+from modules.counting import count_cheaters, count_victims_cheaters, \
+    count_observers_cheaters
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. State
+# Format: SQLite database keyed by match, so an update reads and writes only
+# the rows of affected matches:
+#     matches: {match_id}: teams and kills rows (pickled) and partial results
+#     player_matches: (player_id, match_id) for every player of a match
+#     cheaters: {cheater_id}: start and banned date, as of the last update
+#     histogram, victim_matches, observer_matches: running totals
+# -----------------------------------------------------------------------------
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS matches (match_id TEXT PRIMARY KEY, teams BLOB,
+    kills BLOB, histogram TEXT, victims TEXT, observers TEXT);
+CREATE TABLE IF NOT EXISTS player_matches (player_id TEXT, match_id TEXT,
+    PRIMARY KEY (player_id, match_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS player_matches_match ON player_matches (match_id);
+CREATE TABLE IF NOT EXISTS cheaters (cheater_id TEXT PRIMARY KEY, start TEXT,
+    banned TEXT);
+CREATE TABLE IF NOT EXISTS histogram (num_cheater INTEGER PRIMARY KEY,
+    count INTEGER);
+CREATE TABLE IF NOT EXISTS victim_matches (player_id TEXT PRIMARY KEY,
+    count INTEGER);
+CREATE TABLE IF NOT EXISTS observer_matches (player_id TEXT PRIMARY KEY,
+    count INTEGER);
+'''
+
+BATCH = 900 # Parameters per query, below SQLite's limit
+
+def open_state(path: str) -> sqlite3.Connection:
+    '''Takes path as string.
+       Returns a connection to the state at path, created if there is none.
+    '''
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+def _batches(items) -> list:
+    '''Takes an iterable (items).
+       Returns its items as lists of at most BATCH items.
+    '''
+    items = list(items)
+    return [items[i:i + BATCH] for i in range(0, len(items), BATCH)]
+
+def _placeholders(batch: list) -> str:
+    '''Returns the "?, ?, ..." placeholders for a batch.'''
+    return ', '.join('?' * len(batch))
+
+def _stored_cheaters(connection: sqlite3.Connection) -> dict:
+    '''Takes a connection to the state (connection).
+       Returns the stored cheaters as dict of load_cheaters().
+    '''
+    return {cheater: [datetime.fromisoformat(start), datetime.fromisoformat(banned)]
+            for cheater, start, banned
+            in connection.execute('SELECT cheater_id, start, banned FROM cheaters')}
+
+# -----------------------------------------------------------------------------
+# 2. Per-match partial results
+# Every statistic is a sum (histograms) or union (sets) over matches, so a
+# match's old partial result is subtracted and its new one added
+# -----------------------------------------------------------------------------
+
+def _add_totals(connection: sqlite3.Connection, table: str, key: str, deltas: Counter):
+    '''Takes a connection to the state (connection), a totals table (table),
+           its key column (key) and the changes per key (deltas).
+       Adds the changes and drops keys whose total becomes 0.
+    '''
+    deltas = [(value, delta) for value, delta in deltas.items() if delta]
+    connection.executemany(f'INSERT INTO {table} VALUES (?, ?) ON CONFLICT ({key}) '
+                           f'DO UPDATE SET count = count + excluded.count', deltas)
+    connection.executemany(f'DELETE FROM {table} WHERE {key} = ? AND count = 0',
+                           [(value,) for value, _ in deltas])
+
+def _update_matches(connection: sqlite3.Connection, matches: list, dict_cheaters: dict):
+    '''Takes a connection to the state (connection), a batch of match ids
+           (matches) and the current cheaters (dict_cheaters).
+       Recounts the matches, relinks their players and updates the totals.
+    '''
+    histogram, victim_matches, observer_matches = Counter(), Counter(), Counter()
+    links = []
+
+    rows = connection.execute(f'SELECT match_id, teams, kills, histogram, victims, observers '
+                              f'FROM matches WHERE match_id IN ({_placeholders(matches)})',
+                              matches).fetchall()
+    for match, teams, kills, old_histogram, old_victims, old_observers in rows:
+        for num_cheater, count in json.loads(old_histogram or '{}').items():
+            histogram[int(num_cheater)] -= count
+        victim_matches.subtract(json.loads(old_victims or '[]'))
+        observer_matches.subtract(json.loads(old_observers or '[]'))
+
+        new_histogram, victims, observers, players = {}, set(), set(), set()
+        if teams is not None:
+            teams = pickle.loads(teams)
+            new_histogram = count_cheaters({match: teams}, dict_cheaters)
+            players.update(teams[1])
+        if kills is not None:
+            kills = pickle.loads(kills)
+            victims = count_victims_cheaters({match: kills}, dict_cheaters)
+            observers = count_observers_cheaters({match: kills}, dict_cheaters)
+            players.update(kills[0], kills[1])
+
+        histogram.update(new_histogram)
+        victim_matches.update(victims)
+        observer_matches.update(observers)
+        links.extend((player, match) for player in players)
+
+        connection.execute('UPDATE matches SET histogram = ?, victims = ?, observers = ? '
+                           'WHERE match_id = ?',
+                           (json.dumps(new_histogram), json.dumps(sorted(victims)),
+                            json.dumps(sorted(observers)), match))
+
+    connection.execute(f'DELETE FROM player_matches WHERE match_id IN ({_placeholders(matches)})',
+                       matches)
+    connection.executemany('INSERT INTO player_matches VALUES (?, ?)', links)
+
+    _add_totals(connection, 'histogram', 'num_cheater', histogram)
+    _add_totals(connection, 'victim_matches', 'player_id', victim_matches)
+    _add_totals(connection, 'observer_matches', 'player_id', observer_matches)
+
+def totals(connection: sqlite3.Connection) -> tuple:
+    '''Takes a connection to the state (connection).
+       Returns the counts of cheaters per team, as count_cheaters(), and the
+           sets of victims and observers who became cheaters, as
+           count_victims_cheaters() and count_observers_cheaters(), over all
+           matches.
+    '''
+    histogram = dict(connection.execute('SELECT num_cheater, count FROM histogram'))
+    histogram = {num_cheater: histogram.get(num_cheater, 0)
+                 for num_cheater in sorted(set(range(5)) | histogram.keys())}
+    victims = {player for (player,) in
+               connection.execute('SELECT player_id FROM victim_matches WHERE count > 0')}
+    observers = {player for (player,) in
+                 connection.execute('SELECT player_id FROM observer_matches WHERE count > 0')}
+
+    return histogram, victims, observers
+
+# -----------------------------------------------------------------------------
+# 3. Incremental update
+# A match in the new rows replaces its stored rows, so a changed match is
+# delivered with all of its rows and a match delivered twice counts once
+# -----------------------------------------------------------------------------
+
+def update(connection: sqlite3.Connection, teams_path: str = None,
+           kills_path: str = None, cheaters_path: str = None) -> set:
+    '''Takes a connection to the state (connection), paths to files with the
+           rows of new or changed matches of team_ids.txt (teams_path) and
+           kills.txt (kills_path), and a path to the full, current
+           cheaters.txt (cheaters_path). Any path may be None.
+       Replaces the stored rows of the delivered matches and re-evaluates
+           only those and the matches containing a player whose cheater
+           entry changed, in one transaction.
+       Returns the set of re-evaluated matches.
+    '''
+    affected = set()
+
+    with connection:
+        if teams_path is not None:
+            dict_teams = load_teams(teams_path)
+            connection.executemany('INSERT INTO matches (match_id, teams) VALUES (?, ?) '
+                                   'ON CONFLICT (match_id) DO UPDATE SET teams = excluded.teams',
+                                   [(match, pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+                                    for match, rows in dict_teams.items()])
+            affected.update(dict_teams)
+
+        if kills_path is not None:
+            dict_kills = load_kills(kills_path)
+            connection.executemany('INSERT INTO matches (match_id, kills) VALUES (?, ?) '
+                                   'ON CONFLICT (match_id) DO UPDATE SET kills = excluded.kills',
+                                   [(match, pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+                                    for match, rows in dict_kills.items()])
+            affected.update(dict_kills)
+
+        if cheaters_path is not None:
+            dict_cheaters = load_cheaters(cheaters_path)
+            stored = _stored_cheaters(connection)
+            changed = [player for player in dict_cheaters.keys() | stored.keys()
+                       if dict_cheaters.get(player) != stored.get(player)]
+
+            connection.executemany('DELETE FROM cheaters WHERE cheater_id = ?',
+                                   [(player,) for player in changed])
+            connection.executemany('INSERT INTO cheaters VALUES (?, ?, ?)',
+                                   [(player, dict_cheaters[player][0].isoformat(),
+                                     dict_cheaters[player][1].isoformat())
+                                    for player in changed if player in dict_cheaters])
+            for batch in _batches(changed):
+                affected.update(match for (match,) in connection.execute(
+                    f'SELECT DISTINCT match_id FROM player_matches '
+                    f'WHERE player_id IN ({_placeholders(batch)})', batch))
+        elif affected:
+            dict_cheaters = _stored_cheaters(connection)
+
+        for batch in _batches(affected):
+            _update_matches(connection, batch, dict_cheaters)
+
+    return affected
+
+def update_files(state_path: str, teams_path: str = None, kills_path: str = None,
+                 cheaters_path: str = None) -> tuple:
+    '''Takes the path of the state (state_path) and the paths of update().
+       Applies the update and prints the updated totals.
+       Returns the output of totals().
+    '''
+    connection = open_state(state_path)
+    try:
+        affected = update(connection, teams_path, kills_path, cheaters_path)
+        histogram, victims, observers = totals(connection)
+    finally:
+        connection.close()
+
+    print(f'--- Matches re-evaluated: {len(affected)} ---')
+    print('--- Number of cheaters per team ---')
+    for num_cheater, count in histogram.items():
+        print(f'\tTeams with {num_cheater} cheaters: {count}')
+    print(f'\tNumber of victims becoming cheaters: {len(victims)}')
+    print(f'\tNumber of observers becoming cheaters: {len(observers)}')
+
+    return histogram, victims, observers
+
+if __name__ == '__name__':
+    main()
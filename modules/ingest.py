@@ -0,0 +1,213 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing functions for parallel, chunked ingest of the input files
+# 1. Line-aligned byte ranges
+# 2. Vectorized parsing
+# 3. Parallel ingest
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from modules.dataset import CheaterIndex, assemble_dataset, \
+    EPOCH, ONE_US
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. Line-aligned byte ranges
+# Returns: list of (start, stop) byte offsets, each starting at a line
+# -----------------------------------------------------------------------------
+
+def byte_ranges(path: str, chunk_size: int = 64 << 20) -> list:
+    '''Takes a path (path) and a target chunk size in bytes (chunk_size).
+       Splits the file into ranges of about chunk_size bytes. Every range
+           ends just after a newline, so no line is split.
+       Returns a list of (start, stop) byte offsets.
+    '''
+    size = os.path.getsize(path)
+    ranges, start = [], 0
+
+    with open(path, 'rb') as file:
+        while start < size:
+            file.seek(min(start + chunk_size, size))
+            file.readline() # Move to the end of the current line
+            stop = min(file.tell(), size)
+            ranges.append((start, stop))
+            start = stop
+
+    return ranges
+
+def read_range(path: str, start: int, stop: int) -> bytes:
+    '''Takes a path (path) and a byte range (start, stop).
+       Returns the bytes of that range.
+    '''
+    with open(path, 'rb') as file:
+        file.seek(start)
+        return file.read(stop - start)
+
+# -----------------------------------------------------------------------------
+# 2. Vectorized parsing
+# Rows are split into columns by one bytes.split() call, and fixed-format
+# dates and timestamps are decoded by slicing digit columns
+# -----------------------------------------------------------------------------
+
+def split_columns(data: bytes, n_columns: int, n_tokens: int = None) -> list:
+    '''Takes tab-separated rows (data), the number of columns (n_columns) and
+           the number of whitespace-separated tokens per row (n_tokens).
+       Splits all rows at once on whitespace. Falls back to splitting each
+           line on tabs if IDs contain spaces.
+       Returns a list of n_tokens byte-string arrays, one per token.
+    '''
+    n_tokens = n_tokens or n_columns
+    tokens = data.split()
+    n_rows = len(tokens) // n_tokens
+
+    if len(tokens) % n_tokens or data.count(b'\t') != n_rows * (n_columns - 1):
+        rows = [line.split(b'\t') for line in data.splitlines() if line]
+        rows = [row[:-1] + row[-1].split(b' ', n_tokens - n_columns) for row in rows]
+        tokens = [token for row in rows for token in row]
+
+    return [np.array(tokens[column::n_tokens], dtype=bytes) if tokens 
+            else np.empty(0, dtype='S1') for column in range(n_tokens)]
+
+def _digits(text: np.ndarray, start: int, stop: int) -> np.ndarray:
+    '''Takes a fixed-width byte-string array (text) and a character range
+           (start, stop).
+       Returns the decimal number in that range of every entry as int64.
+    '''
+    chars = text.view(np.uint8).reshape(len(text), -1)[:, start:stop].astype(np.int64) - 48
+    return chars @ 10 ** np.arange(stop - start - 1, -1, -1, dtype=np.int64)
+
+def parse_dates(dates: np.ndarray) -> np.ndarray:
+    '''Takes an array of b'YYYY-MM-DD' dates (dates).
+       Returns the dates as int64 microseconds since the epoch.
+    '''
+    dates = np.ascontiguousarray(dates, dtype='S10')
+    months = (_digits(dates, 0, 4) - 1970) * 12 + _digits(dates, 5, 7) - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') \
+        + (_digits(dates, 8, 10) - 1).astype('timedelta64[D]')
+
+    return days.astype('datetime64[us]').astype(np.int64)
+
+def parse_timestamps(dates: np.ndarray, times: np.ndarray) -> np.ndarray:
+    '''Takes arrays of b'YYYY-MM-DD' dates (dates) and b'HH:MM:SS.ffffff'
+           times (times), as in kills.txt.
+       Uses numpy's own parser if the fraction of a second is not 6 digits.
+       Returns the timestamps as int64 microseconds since the epoch.
+    '''
+    if (np.char.str_len(times) != 15).any():
+        stamps = np.char.add(np.char.add(dates, b' '), times)
+        return stamps.astype('datetime64[us]').astype(np.int64)
+
+    times = np.ascontiguousarray(times, dtype='S15')
+    seconds = _digits(times, 0, 2) * 3600 + _digits(times, 3, 5) * 60 + _digits(times, 6, 8)
+
+    return parse_dates(dates) + seconds * 1000000 + _digits(times, 9, 15)
+
+def _parse_kills(task: tuple) -> tuple:
+    '''Takes a task (path, start, stop).
+       Returns the match, killer and victim columns as byte strings and the
+           timestamps as int64.
+    '''
+    match, killer, victim, date, time = split_columns(read_range(*task), 4, 5)
+    return match, killer, victim, parse_timestamps(date, time)
+
+def _parse_teams(task: tuple) -> tuple:
+    '''Takes a task (path, start, stop).
+       Returns the match and player columns as byte strings and the team
+           column as int64.
+    '''
+    match, player, team = split_columns(read_range(*task), 3)
+    return match, player, team.astype(np.int64)
+
+def _parse_cheaters(task: tuple) -> tuple:
+    '''Takes a task (path, start, stop).
+       Returns the cheater column as byte strings and the start and ban dates
+           as int64.
+    '''
+    cheater, start, banned = split_columns(read_range(*task), 3)
+    return cheater, parse_dates(start), parse_dates(banned)
+
+# -----------------------------------------------------------------------------
+# 3. Parallel ingest
+# All chunks of all three files are parsed concurrently in one process pool
+# -----------------------------------------------------------------------------
+
+def _intern(*columns) -> tuple:
+    '''Takes byte-string columns (columns) sharing one vocabulary.
+       Returns the vocabulary as str array and the int32 codes of each column.
+    '''
+    vocabulary, codes = np.unique(np.concatenate(columns), return_inverse=True)
+    bounds = np.cumsum([0] + [len(column) for column in columns])
+
+    return (np.char.decode(vocabulary, 'utf-8'),
+            *(codes.ravel()[lo:hi].astype(np.int32) for lo, hi in zip(bounds, bounds[1:])))
+
+def ingest(teams_path: str, kills_path: str, cheaters_path: str = None,
+           workers: int = None, chunk_size: int = 64 << 20) -> tuple:
+    '''Takes paths to the team_ids.txt (teams_path), kills.txt (kills_path) and
+           cheaters.txt (cheaters_path) files, the number of processes
+           (workers) and the chunk size in bytes (chunk_size). Any path may be
+           None.
+       Parses line-aligned chunks of all three files concurrently, without
+           per-row datetime objects.
+       Returns a ColumnarDataset, as load_dataset(), and the dict of
+           load_cheaters().
+    '''
+    def submit(parser, path: str) -> list:
+        if path is None:
+            return []
+        return [pool.submit(parser, (path, *chunk)) 
+                for chunk in byte_ranges(path, chunk_size)]
+    
+    with ProcessPoolExecutor(workers) as pool:
+        kills = submit(_parse_kills, kills_path)
+        teams = submit(_parse_teams, teams_path)
+        cheaters = submit(_parse_cheaters, cheaters_path)
+
+        kills = _concatenate([future.result() for future in kills], 4)
+        teams = _concatenate([future.result() for future in teams], 3)
+        cheaters = _concatenate([future.result() for future in cheaters], 3)
+
+    match_ids, team_match, kill_match = _intern(teams[0], kills[0])
+    player_ids, team_player, killer, victim = _intern(teams[1], kills[1], kills[2])
+    team_ids, team_codes = np.unique(teams[2], return_inverse=True)
+
+    dataset = assemble_dataset(match_ids, player_ids, team_ids.astype(str),
+                               (team_match, team_player, team_codes.ravel()),
+                               (kill_match, killer, victim, kills[3]))
+
+    dict_cheaters = {}
+    for cheater, start, banned in zip(np.char.decode(cheaters[0], 'utf-8'),
+                                      cheaters[1].tolist(), cheaters[2].tolist()):
+        dict_cheaters.setdefault(str(cheater), [EPOCH + start * ONE_US,
+                                                EPOCH + banned * ONE_US])
+
+    return dataset, dict_cheaters
+
+def load_cheater_index(path: str, chunk_size: int = 64 << 20) -> CheaterIndex:
+    '''Takes path as string and the chunk size in bytes (chunk_size).
+       Parses the cheaters.txt file chunk by chunk, without per-row datetime
+           objects.
+       Returns a CheaterIndex.
+    '''
+    cheaters = _concatenate([_parse_cheaters((path, *chunk)) 
+                             for chunk in byte_ranges(path, chunk_size)], 3)
+    return CheaterIndex(np.char.decode(cheaters[0], 'utf-8'), cheaters[1], cheaters[2])
+
+def _concatenate(chunks: list, n_columns: int) -> list:
+    '''Takes parsed chunks (chunks), each a tuple of n_columns arrays.
+       Returns one array per column.
+    '''
+    if not chunks:
+        return [np.empty(0, dtype='S1')] * n_columns
+    return [np.concatenate([chunk[column] for chunk in chunks])
+            for column in range(n_columns)]
+
+if __name__ == '__name__':
+    main()
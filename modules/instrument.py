@@ -0,0 +1,250 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing the instrumentation of loaders, randomisers and counters
+# 1. Stages
+# 2. Instrumented functions
+# 3. Enabling and reporting
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import json
+import pstats
+import cProfile
+import inspect
+import functools
+import contextlib
+import tracemalloc
+from modules import loading, dataset, ingest, cache, randomisation, counting
+from modules.dataset import ColumnarDataset
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. Stages
+# Format: {stage name}: {group, calls, wall_s, cpu_s, peak_traced_mb,
+#     max_rss_mb, matches, kills, reps}
+# Calls of the same stage are aggregated. Times are inclusive of nested
+# stages. peak_traced_mb is the largest increase of traced memory during a
+# call, if tracemalloc is running.
+# -----------------------------------------------------------------------------
+
+_STAGES = {}
+_STACK = [] # Peak traced memory of the open stages
+MB = 2 ** 20
+
+def _max_rss_mb() -> float:
+    '''Returns the peak resident memory of the process in MB, or None.'''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / MB if sys.platform == 'darwin' else rss / 1024 # kB on Linux
+
+def _traced() -> tuple:
+    '''Returns the current and peak traced memory, or (0, 0).'''
+    return tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+
+@contextlib.contextmanager
+def stage(name: str, group: str = 'stage', **counts):
+    '''Takes a stage name (name), a group (group) and workload counts
+           (counts) such as matches, kills or reps.
+       Records wall time, CPU time and memory of the enclosed block under
+           name. Counts can be added to the yielded dict inside the block.
+    '''
+    if _STACK:
+        _STACK[-1]['peak'] = max(_STACK[-1]['peak'], _traced()[1])
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = _traced()[0]
+    _STACK.append({'peak': start})
+
+    counts = dict(counts)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield counts
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        peak = max(_STACK.pop()['peak'], _traced()[1])
+        if _STACK:
+            _STACK[-1]['peak'] = max(_STACK[-1]['peak'], peak)
+
+        record = _STAGES.setdefault(name, {'group': group, 'calls': 0, 'wall_s': 0.0,
+                                           'cpu_s': 0.0, 'peak_traced_mb': 0.0,
+                                           'max_rss_mb': None, 'matches': 0,
+                                           'kills': 0, 'reps': 0})
+        record['calls'] += 1
+        record['wall_s'] += wall
+        record['cpu_s'] += cpu
+        record['peak_traced_mb'] = max(record['peak_traced_mb'], (peak - start) / MB)
+        record['max_rss_mb'] = _max_rss_mb()
+        for key, value in counts.items():
+            record[key] = record.get(key, 0) + (value or 0)
+
+# -----------------------------------------------------------------------------
+# 2. Instrumented functions
+# Every loader, randomiser and counter is wrapped in a stage of its own name.
+# Matches and kills are read from the data passed in, or returned by a
+# loader; reps from the function's reps argument.
+# -----------------------------------------------------------------------------
+
+INSTRUMENTED = {
+    'load': [(loading, ['load_teams', 'load_kills', 'load_cheaters']),
+             (dataset, ['load_dataset', 'build_dataset']),
+             (ingest, ['ingest', 'load_cheater_index']),
+             (cache, ['load_dataset_cached', 'load_cheaters_cached',
+                      'load_cheater_index_cached'])],
+    'randomise': [(randomisation, ['randomise_team_ids', 'randomise_player_ids',
+                                   'randomise_team_codes', 'randomise_player_codes',
+                                   'team_permutations'])],
+    'count': [(counting, ['count_cheaters', 'count_victims_cheaters',
+                          'count_observers_cheaters', 'count_contagion',
+                          'count_cheaters_batched', 'count_observers_sweep'])],
+    'expect': [(counting, ['exp_count_cheaters', 'exp_count_cheaters_batched',
+                           'exp_count_cheaters_exact', 'exp_count_victims_cheaters',
+                           'exp_count_observers_cheaters', 'exp_count_contagion',
+                           'sweep_observers_cheaters'])],
+}
+
+def workload(data) -> dict:
+    '''Takes teams or kills data (data), as dict or ColumnarDataset, or a
+           tuple holding a ColumnarDataset, as returned by ingest().
+       Returns a dict with the number of matches and kills, or {}.
+    '''
+    if isinstance(data, tuple) and data and isinstance(data[0], ColumnarDataset):
+        data = data[0]
+    if isinstance(data, ColumnarDataset):
+        return {'matches': data.n_matches, 'kills': len(data.killers)}
+    if isinstance(data, dict) and data:
+        rows = next(iter(data.values()))
+        if isinstance(rows, list) and len(rows) == 3: # {match_id}: [[killers], [victims], [dates]]
+            return {'matches': len(data), 'kills': sum(len(row[0]) for row in data.values())}
+        if isinstance(rows, list) and len(rows) == 2 and isinstance(rows[0], list):
+            return {'matches': len(data)}
+    return {}
+
+def instrumented(function, group: str):
+    '''Takes a function (function) and its group (group).
+       Returns the function wrapped in a stage named after it.
+    '''
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            arguments = arguments.arguments
+        except TypeError:
+            arguments = {}
+
+        with stage(function.__name__, group, reps=arguments.get('reps')) as counts:
+            result = function(*args, **kwargs)
+            counts.update(workload(args[0] if args else None) or workload(result))
+        return result
+
+    wrapper.__wrapped_original__ = function
+    return wrapper
+
+# -----------------------------------------------------------------------------
+# 3. Enabling and reporting
+# enable() rebinds the instrumented functions in every loaded module that
+# imported them, including analysis.py. Repetitions run in forked workers
+# are not recorded, only the enclosing exp_count_* call.
+# -----------------------------------------------------------------------------
+
+_PROFILER = None
+
+def _rebind(original, replacement):
+    '''Takes a function (original) and its replacement (replacement).
+       Rebinds every module-level name bound to original.
+    '''
+    for module in list(sys.modules.values()):
+        namespace = getattr(module, '__dict__', None)
+        if not namespace:
+            continue
+        for name, value in list(namespace.items()):
+            if value is original:
+                namespace[name] = replacement
+
+def enable(memory: bool = True, profile: bool = False):
+    '''Takes bool (memory) whether to trace peak memory with tracemalloc and
+           bool (profile) whether to run cProfile over the whole run.
+       Wraps every function in INSTRUMENTED and clears earlier records.
+    '''
+    global _PROFILER
+
+    _STAGES.clear()
+    for group, entries in INSTRUMENTED.items():
+        for module, names in entries:
+            for name in names:
+                function = getattr(module, name)
+                if not hasattr(function, '__wrapped_original__'):
+                    _rebind(function, instrumented(function, group))
+
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if profile:
+        _PROFILER = cProfile.Profile()
+        _PROFILER.enable()
+
+def disable():
+    '''Restores the original functions and stops tracing and profiling.'''
+    global _PROFILER
+
+    for entries in INSTRUMENTED.values():
+        for module, names in entries:
+            for name in names:
+                function = getattr(module, name)
+                if hasattr(function, '__wrapped_original__'):
+                    _rebind(function, function.__wrapped_original__)
+
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    if _PROFILER is not None:
+        _PROFILER.disable()
+        _PROFILER = None
+
+def report(path: str = None, top: int = 30) -> dict:
+    '''Takes a path for the JSON report (path) and the number of profiled
+           functions to include (top).
+       If profiling, also saves the raw cProfile stats next to the report.
+       Returns the report as dict: metadata, one entry per stage and, if
+           profiling, the top functions by cumulative time.
+    '''
+    result = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': sys.version.split()[0],
+                       'pid': os.getpid(),
+                       'max_rss_mb': _max_rss_mb(),
+                       'memory_traced': tracemalloc.is_tracing()},
+              'stages': {name: dict(record) for name, record in _STAGES.items()}}
+
+    if _PROFILER is not None:
+        _PROFILER.disable()
+        stats = pstats.Stats(_PROFILER)
+        if path is not None:
+            stats.dump_stats(os.path.splitext(path)[0] + '.prof')
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        result['profile'] = [{'function': f'{file}:{line}({name})', 'calls': calls,
+                              'tottime_s': tottime, 'cumtime_s': cumtime}
+                             for (file, line, name), (_, calls, tottime, cumtime, _)
+                             in rows[:top]]
+        _PROFILER.enable()
+
+    if path is not None:
+        with open(path, 'w') as file:
+            json.dump(result, file, indent=1)
+
+    return result
+
+if __name__ == '__name__':
+    main()
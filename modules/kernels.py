@@ -0,0 +1,170 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing the per-match kernels of the observer and victim counters
+# 1. Optional Numba
+# 2. NumPy kernels
+# 3. Loop kernels
+# 4. Dispatch
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import numpy as np
+from modules.dataset import ColumnarDataset
+
+try:
+    import numba
+except ImportError: # Numba is optional, the NumPy kernels give the same results
+    numba = None
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. Optional Numba
+# Loop kernels are compiled with numba.njit if Numba is installed, and cached
+# on disk next to this file. Without Numba the NumPy kernels are used.
+# -----------------------------------------------------------------------------
+
+HAVE_NUMBA = numba is not None
+BACKEND = 'numba' if HAVE_NUMBA else 'numpy'
+
+def jit(function):
+    '''Takes a function over flat arrays (function).
+       Returns it compiled with numba.njit, or unchanged without Numba.
+    '''
+    return numba.njit(cache=True)(function) if HAVE_NUMBA else function
+
+# -----------------------------------------------------------------------------
+# 2. NumPy kernels
+# All matches at once, with sorting and offset arithmetic
+# -----------------------------------------------------------------------------
+
+def running_kill_counts_numpy(dataset: ColumnarDataset, qualifies: np.ndarray) -> np.ndarray:
+    '''Takes a ColumnarDataset (dataset) and a bool mask of the kills to count
+           (qualifies).
+       Counts for each qualifying kill how many qualifying kills its killer
+           has made in the match so far, itself included (a group cumcount).
+       Returns an int64 array, 0 for kills that do not qualify.
+    '''
+    counts = np.zeros(len(dataset.killers), dtype=np.int64)
+    rows = np.flatnonzero(qualifies)
+    if not len(rows):
+        return counts
+
+    keys = dataset.kill_match_index()[rows].astype(np.int64) * dataset.n_players \
+        + dataset.killers[rows]
+    order = np.argsort(keys, kind='stable') # Keeps time order within a group
+    sorted_keys = keys[order]
+
+    position = np.arange(len(rows))
+    new_group = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    group_start = np.maximum.accumulate(np.where(new_group, position, 0))
+    counts[rows[order]] = position - group_start + 1
+
+    return counts
+
+def observed_kills_numpy(dataset: ColumnarDataset, kill_counts: np.ndarray,
+                         match_index: np.ndarray, window_floor: np.ndarray,
+                         threshold: int = 3) -> np.ndarray:
+    '''Takes a ColumnarDataset (dataset), the output of running_kill_counts()
+           for kills by active cheaters (kill_counts), the match of each kill
+           (match_index), the first kill observing each kill (window_floor),
+           e.g. first_same_time() + 1, and a number of kills (threshold).
+       Finds the threshold-th kill of each active cheater in a match.
+       Returns a bool mask of the kills whose victims observed such a kill.
+    '''
+    triggers = np.flatnonzero(kill_counts == threshold)
+
+    # Every window runs to the end of the match and window_floor does not
+    # decrease within a match, so the first trigger of a match covers all
+    # others.
+    matches, first_trigger = np.unique(match_index[triggers], return_index=True)
+    window_start = np.full(dataset.n_matches, len(match_index), dtype=np.int64)
+    window_start[matches] = window_floor[triggers[first_trigger]]
+
+    return np.arange(len(match_index)) >= window_start[match_index]
+
+# -----------------------------------------------------------------------------
+# 3. Loop kernels
+# One pass over the kills of each match in time order, as the dict-based
+# counters do. Only flat arrays and scalars go in, so Numba can compile them.
+# -----------------------------------------------------------------------------
+
+@jit
+def running_kill_counts_loop(kill_offsets, killers, qualifies, n_players):
+    '''Takes the kill offsets of each match (kill_offsets), the killer codes
+           (killers), a bool mask of the kills to count (qualifies) and the
+           number of player codes (n_players).
+       Counts per match in a scratch array, reset after each match.
+       Returns an int64 array as running_kill_counts_numpy().
+    '''
+    counts = np.zeros(len(killers), dtype=np.int64)
+    scratch = np.zeros(n_players, dtype=np.int64)
+
+    for match in range(len(kill_offsets) - 1):
+        begin, end = kill_offsets[match], kill_offsets[match + 1]
+        for i in range(begin, end):
+            if qualifies[i]:
+                scratch[killers[i]] += 1
+                counts[i] = scratch[killers[i]]
+        for i in range(begin, end):
+            scratch[killers[i]] = 0
+
+    return counts
+
+@jit
+def observed_kills_loop(kill_offsets, kill_counts, window_floor, threshold):
+    '''Takes the kill offsets of each match (kill_offsets), the running kill
+           counts (kill_counts), the first kill observing each kill
+           (window_floor) and a number of kills (threshold).
+       Marks the kills of a match from the window of its first trigger on.
+       Returns a bool mask as observed_kills_numpy().
+    '''
+    observed = np.zeros(len(kill_counts), dtype=np.bool_)
+
+    for match in range(len(kill_offsets) - 1):
+        begin, end = kill_offsets[match], kill_offsets[match + 1]
+        for i in range(begin, end):
+            if kill_counts[i] == threshold:
+                for j in range(max(window_floor[i], begin), end):
+                    observed[j] = True
+                break
+
+    return observed
+
+# -----------------------------------------------------------------------------
+# 4. Dispatch
+# Same signatures as the NumPy kernels; backend is 'numba', 'numpy' or None
+# for BACKEND. 'numba' without Numba runs the loop kernels uncompiled.
+# -----------------------------------------------------------------------------
+
+def running_kill_counts(dataset: ColumnarDataset, qualifies: np.ndarray,
+                        backend: str = None) -> np.ndarray:
+    '''Takes a ColumnarDataset (dataset), a bool mask of the kills to count
+           (qualifies) and the kernel to use (backend).
+       Returns the output of running_kill_counts_numpy().
+    '''
+    if (backend or BACKEND) == 'numpy':
+        return running_kill_counts_numpy(dataset, qualifies)
+    return running_kill_counts_loop(dataset.kill_offsets.astype(np.int64),
+                                    dataset.killers, np.asarray(qualifies, dtype=bool),
+                                    dataset.n_players)
+
+def observed_kills(dataset: ColumnarDataset, kill_counts: np.ndarray,
+                   match_index: np.ndarray, window_floor: np.ndarray,
+                   threshold: int = 3, backend: str = None) -> np.ndarray:
+    '''Takes the arguments of observed_kills_numpy() and the kernel to use
+           (backend).
+       Returns the output of observed_kills_numpy().
+    '''
+    if (backend or BACKEND) == 'numpy':
+        return observed_kills_numpy(dataset, kill_counts, match_index,
+                                    window_floor, threshold)
+    return observed_kills_loop(dataset.kill_offsets.astype(np.int64),
+                               np.asarray(kill_counts, dtype=np.int64),
+                               np.asarray(window_floor, dtype=np.int64), threshold)
+
+if __name__ == '__name__':
+    main()
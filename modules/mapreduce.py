@@ -0,0 +1,227 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing mergeable partial results for map/reduce runs over shards
+# 1. Partial results of a subset of matches
+# 2. Reducer
+# 3. Local multi-process runner
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from modules.dataset import ColumnarDataset, load_dataset
+from modules.randomisation import randomise_player_codes, player_permutation_index
+from modules.counting import count_cheaters, count_contagion, contagion_state, \
+    exact_team_moments, team_count_statistic, print_exp_count_cheaters, null_range
+from modules.parallel import run_reps, master_seed
+from modules.ingest import load_cheater_index
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. Partial results of a subset of matches
+# Every statistic is a sum over matches: histograms add up, sets of new
+# cheaters unite, and so do the per-repetition histograms and sets, since
+# every randomiser only moves players within a match.
+# Format: JSON-serializable dict, see partial_result()
+# -----------------------------------------------------------------------------
+
+def contagion_sets_statistic(dataset: ColumnarDataset, dict_cheaters: dict):
+    '''Takes a ColumnarDataset (dataset) and a dict with cheaters
+           (dict_cheaters).
+       Returns a function for run_reps(), mapping a list of generators to the
+           sets of victims and observers who became cheaters in one
+           alternative world per generator.
+    '''
+    index = player_permutation_index(dataset)
+    state = contagion_state(dataset, dict_cheaters)
+
+    def statistic(rngs: list) -> list:
+        return [count_contagion(randomise_player_codes(dataset, rng, index),
+                                dict_cheaters, state)
+                for rng in rngs]
+
+    return statistic
+
+def partial_result(dataset: ColumnarDataset, dict_cheaters: dict,
+                   reps: int = 20, seed: int = None, shard: int = 0) -> dict:
+    '''Takes a ColumnarDataset (dataset) with a subset of the matches, a dict
+           with cheaters (dict_cheaters), the number of repetitions (reps), a
+           master seed (seed) and the index of the subset (shard).
+       Repetitions of a shard draw from their own streams, keyed by
+           (seed, shard), so a run is reproducible for a given seed and
+           sharding.
+       Returns a dict with the observed counts, the exact team moments and
+           the counts of every repetition.
+    '''
+    seed = master_seed(seed)
+    shard_seed = [seed, shard]
+
+    histogram = count_cheaters(dataset, dict_cheaters)
+    victims, observers = count_contagion(dataset, dict_cheaters)
+    mean, var = exact_team_moments(dataset, dict_cheaters)
+
+    rep_histograms = run_reps(team_count_statistic(dataset, dict_cheaters),
+                              reps, shard_seed)
+    rep_sets = run_reps(contagion_sets_statistic(dataset, dict_cheaters),
+                        reps, shard_seed)
+
+    return {'shard': shard,
+            'seed': seed,
+            'reps': reps,
+            'matches': dataset.n_matches,
+            'histogram': [histogram[k] for k in range(max(histogram) + 1)],
+            'team_mean': mean.tolist(),
+            'team_var': var.tolist(),
+            'victims': sorted(victims),
+            'observers': sorted(observers),
+            'rep_histograms': rep_histograms.tolist(),
+            'rep_victims': [sorted(sets[0]) for sets in rep_sets],
+            'rep_observers': [sorted(sets[1]) for sets in rep_sets]}
+
+def save_partial(partial: dict, path: str):
+    '''Takes a partial result (partial) and path as string.
+       Writes the partial result as JSON, atomically.
+    '''
+    with open(path + '.tmp', 'w') as file:
+        json.dump(partial, file)
+    os.replace(path + '.tmp', path)
+
+def load_partial(path: str) -> dict:
+    '''Takes path as string.
+       Returns the partial result saved at path.
+    '''
+    with open(path, 'r') as file:
+        return json.load(file)
+
+# -----------------------------------------------------------------------------
+# 2. Reducer
+# Observed counts and the exact team moments equal those of a single run
+# over all matches; variances add up since matches are shuffled
+# independently
+# -----------------------------------------------------------------------------
+
+def _sum_padded(rows: list) -> np.ndarray:
+    '''Takes a list of 1-D or 2-D arrays whose last axis may differ (rows).
+       Returns their sum, padding the last axis with zeros.
+    '''
+    width = max(np.shape(row)[-1] for row in rows)
+    return sum(np.pad(np.asarray(row, dtype=float),
+                      [(0, 0)] * (np.ndim(row) - 1) + [(0, width - np.shape(row)[-1])])
+               for row in rows)
+
+def reduce_partials(partials: list, z_value: float = 1.96) -> dict:
+    '''Takes a list of partial results (partials) over disjoint subsets of
+           matches, all with the same seed and number of repetitions, and a
+           z-value (z_value).
+       Returns a dict with, for 'cheaters', the observed counts per number of
+           cheaters, the exact and Monte Carlo expectations with CIs, as
+           exp_count_cheaters_exact() and exp_count_cheaters(), the null sd
+           and range, as null_range(), and, for
+           'victims' and 'observers', the observed count and the expected
+           mean with CI, as exp_count_contagion().
+    '''
+    if len({(partial['seed'], partial['reps']) for partial in partials}) > 1:
+        raise ValueError('Partial results differ in seed or repetitions')
+    reps = partials[0]['reps']
+
+    histogram = _sum_padded([partial['histogram'] for partial in partials])
+    mean = _sum_padded([partial['team_mean'] for partial in partials])
+    var = _sum_padded([partial['team_var'] for partial in partials])
+    counts = _sum_padded([np.reshape(partial['rep_histograms'], (reps, -1))
+                          for partial in partials])
+
+    result = {'matches': sum(partial['matches'] for partial in partials),
+              'cheaters': {'observed': {k: int(count) for k, count in enumerate(histogram)
+                                        if k < 5 or count},
+                           'exact': {k: [mean[k], mean[k], mean[k]]
+                                     for k in range(len(mean))},
+                           'null_range': null_range(mean, var, z_value),
+                           'expected': {}}}
+
+    rep_mean, rep_sd = counts.mean(axis=0), counts.std(axis=0)
+    result['cheaters']['expected'] = {k: [rep_mean[k],
+                                          rep_mean[k] - z_value * rep_sd[k] / np.sqrt(reps),
+                                          rep_mean[k] + z_value * rep_sd[k] / np.sqrt(reps)]
+                                      for k in range(len(rep_mean))}
+
+    for task in ['victims', 'observers']:
+        observed = set().union(*(partial[task] for partial in partials))
+        rep_counts = np.array([len(set().union(*(partial[f'rep_{task}'][rep]
+                                                 for partial in partials)))
+                               for rep in range(reps)])
+        rep_mean, rep_sd = rep_counts.mean(), rep_counts.std()
+        result[task] = {'observed': len(observed),
+                        'expected': [rep_mean,
+                                     rep_mean - z_value * rep_sd / np.sqrt(reps),
+                                     rep_mean + z_value * rep_sd / np.sqrt(reps)]}
+
+    return result
+
+def print_reduced(result: dict):
+    '''Takes the output of reduce_partials() (result).
+       Pretty-prints the output for users.
+    '''
+    print(f'--- Matches: {result["matches"]} ---')
+    print('--- Number of cheaters per team ---')
+    for num_cheater, count in result['cheaters']['observed'].items():
+        print(f'\tTeams with {num_cheater} cheaters: {count}')
+    print_exp_count_cheaters(result['cheaters']['expected'])
+
+    for task in ['victims', 'observers']:
+        mean, lower, upper = result[task]['expected']
+        print(f'--- Number of {task} becoming cheaters: {result[task]["observed"]} ---')
+        print(f'\tExpected mean: {mean:.2f}')
+        print(f'\t95% confidence interval: [{lower:.2f}, {upper:.2f}]')
+
+# -----------------------------------------------------------------------------
+# 3. Local multi-process runner
+# Stands in for a cluster: every task loads one shard from disk, writes its
+# partial result as JSON and returns the path, like a node would
+# -----------------------------------------------------------------------------
+
+def _map_shard(task: tuple) -> str:
+    '''Takes a task (shard, teams_path, kills_path, cheaters_path, reps,
+           seed, directory).
+       Returns the path of the shard's saved partial result.
+    '''
+    shard, teams_path, kills_path, cheaters_path, reps, seed, directory = task
+    partial = partial_result(load_dataset(teams_path, kills_path),
+                             load_cheater_index(cheaters_path), reps, seed, shard)
+
+    path = os.path.join(directory, f'partial-{shard:04d}.json')
+    save_partial(partial, path)
+    return path
+
+def run_local(shards: list, cheaters_path: str, directory: str, reps: int = 20,
+              seed: int = None, workers: int = None,
+              z_value: float = 1.96) -> dict:
+    '''Takes a list of (teams_shard, kills_shard) paths (shards), as returned
+           by partition(), a path to cheaters.txt (cheaters_path), a directory
+           for the partial results (directory), the number of repetitions
+           (reps), a master seed (seed), the number of processes (workers)
+           and a z-value (z_value).
+       Maps every shard to a partial result in a process pool, then reduces
+           them.
+       Returns and prints the output of reduce_partials().
+    '''
+    seed = master_seed(seed)
+    os.makedirs(directory, exist_ok=True)
+    tasks = [(shard, teams_path, kills_path, cheaters_path, reps, seed, directory)
+             for shard, (teams_path, kills_path) in enumerate(shards)]
+
+    with ProcessPoolExecutor(workers) as pool:
+        paths = list(pool.map(_map_shard, tasks))
+
+    result = reduce_partials([load_partial(path) for path in paths], z_value)
+    print_reduced(result)
+
+    return result
+
+if __name__ == '__name__':
+    main()
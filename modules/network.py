@@ -0,0 +1,155 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing the co-player network and network-level homophily
+# 1. Sparse co-player graph
+# 2. Homophily statistics
+# 3. Label-permutation null model
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import numpy as np
+import scipy.sparse as sparse
+from modules.dataset import ColumnarDataset, build_dataset, cheater_arrays
+from modules.parallel import run_reps
+from modules.nullstore import percentile_interval, empirical_p_value
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. Sparse co-player graph
+# Format: symmetric CSR matrix over player codes; entry [u, v] is the number
+# of matches (or teams) that players u and v played together
+# -----------------------------------------------------------------------------
+
+def coplayer_graph(team_ids, same_team: bool = False) -> tuple:
+    '''Takes teams data (team_ids), as dict or ColumnarDataset, and bool
+           (same_team) whether only teammates count as co-players.
+       Builds the player-by-match incidence matrix B and the co-play counts
+           as B @ B.T, without the diagonal.
+       Returns the CSR adjacency matrix and the ColumnarDataset whose player
+           codes index it.
+    '''
+    dataset = team_ids if isinstance(team_ids, ColumnarDataset) \
+        else build_dataset(dict_teams=team_ids)
+
+    groups = dataset.team_match_index().astype(np.int64)
+    if same_team:
+        groups = groups * len(dataset.team_ids) + dataset.team_codes
+    _, groups = np.unique(groups, return_inverse=True)
+    groups = groups.ravel()
+
+    # A player listed twice in a match still plays it once
+    incidence = sparse.csr_matrix((np.ones(len(groups), dtype=np.int32),
+                                   (dataset.team_players, groups)),
+                                  shape=(dataset.n_players, groups.max() + 1 if len(groups) else 0))
+    incidence.data[:] = 1
+
+    adjacency = (incidence @ incidence.T).tocsr()
+    adjacency.setdiag(0)
+    adjacency.eliminate_zeros()
+
+    return adjacency, dataset
+
+# -----------------------------------------------------------------------------
+# 2. Homophily statistics
+# Labels are a (players, worlds) matrix of 0/1, so one sparse product scores
+# many labelings at once. Edge ends are counted, so every edge counts twice.
+# -----------------------------------------------------------------------------
+
+def homophily(adjacency, labels: np.ndarray) -> np.ndarray:
+    '''Takes a symmetric adjacency matrix (adjacency) and 0/1 cheater labels
+           (labels), one column per labeling.
+       Computes the cheater-cheater share of edge weight and Newman's
+           assortativity coefficient for the two classes.
+       Returns an array of shape (labelings, 2): [edge fraction,
+           assortativity].
+    '''
+    labels = np.asarray(labels, dtype=float).reshape(adjacency.shape[0], -1)
+    degrees = np.asarray(adjacency.sum(axis=1)).ravel()
+    total = degrees.sum()
+
+    cheater_ends = degrees @ labels / total # a_1; a_0 = 1 - a_1
+    both = np.einsum('ij,ij->j', labels, adjacency @ labels) / total # e_11
+    neither = 1 - 2 * cheater_ends + both # e_00
+
+    expected = cheater_ends ** 2 + (1 - cheater_ends) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        assortativity = (both + neither - expected) / (1 - expected)
+
+    return np.column_stack([both, assortativity])
+
+def graph_labels(dataset: ColumnarDataset, dict_cheaters) -> np.ndarray:
+    '''Takes a ColumnarDataset (dataset) and cheaters (dict_cheaters), as
+           dict or CheaterIndex.
+       Returns the 0/1 cheater label of every player code.
+    '''
+    is_cheater, _ = cheater_arrays(dataset, dict_cheaters)
+    return is_cheater.astype(np.int8)
+
+# -----------------------------------------------------------------------------
+# 3. Label-permutation null model
+# The graph stays fixed; cheater labels are shuffled among the players of the
+# graph, one permutation per repetition
+# -----------------------------------------------------------------------------
+
+def label_statistic(adjacency, labels: np.ndarray):
+    '''Takes a symmetric adjacency matrix (adjacency) and 0/1 labels
+           (labels).
+       Returns a function for run_reps(), mapping a list of generators to
+           the homophily() of one shuffled labeling per generator.
+    '''
+    def statistic(rngs: list) -> np.ndarray:
+        shuffled = np.column_stack([rng.permutation(labels) for rng in rngs])
+        return homophily(adjacency, shuffled)
+
+    return statistic
+
+def network_homophily(team_ids, dict_cheaters, reps: int = 200,
+                      seed: int = None, workers: int = 1, level: float = 0.95,
+                      same_team: bool = False, weighted: bool = True) -> dict:
+    '''Takes teams data (team_ids), as dict or ColumnarDataset, cheaters
+           (dict_cheaters), the number of repetitions (reps), a master seed
+           (seed), the number of processes (workers), the interval's coverage
+           (level), bool (same_team) whether only teammates are linked and
+           bool (weighted) whether edges are weighted by shared matches.
+       Compares the observed homophily on the co-player graph with reps
+           label permutations on the same graph.
+       Returns and prints a dict with, per statistic, the observed value, the
+           expected mean, the percentile interval and the empirical p-value.
+    '''
+    adjacency, dataset = coplayer_graph(team_ids, same_team)
+    if not weighted:
+        adjacency.data[:] = 1
+    labels = graph_labels(dataset, dict_cheaters)
+
+    # Players without co-players, e.g. those only in kills data, are not in
+    # the graph and take no part in the shuffle
+    nodes = np.flatnonzero(np.diff(adjacency.indptr) > 0)
+    adjacency, labels = adjacency[nodes][:, nodes], labels[nodes]
+
+    observed = homophily(adjacency, labels)[0]
+    samples = run_reps(label_statistic(adjacency, labels), reps, seed, workers)
+    lower, upper = percentile_interval(samples, level)
+    p_value = empirical_p_value(samples, observed)
+
+    results = {}
+    print('--- Homophily in the co-player network ---')
+    print('------------------------------------------')
+    print(f'\tPlayers: {adjacency.shape[0]}, edges: {adjacency.nnz // 2}, '
+          f'cheaters: {labels.sum()}')
+    for i, name in enumerate(['edge_fraction', 'assortativity']):
+        results[name] = {'observed': observed[i], 'mean': samples[:, i].mean(),
+                         'lower': lower[i], 'upper': upper[i], 'p_value': p_value[i]}
+        print(f'--- {name.replace("_", " ").capitalize()} ---')
+        print(f'\tObserved: {observed[i]:.4f}')
+        print(f'\tExpected mean: {samples[:, i].mean():.4f}')
+        print(f'\t{level:.0%} percentile interval: [{lower[i]:.4f}, {upper[i]:.4f}]')
+        print(f'\tEmpirical p-value: {p_value[i]:.4f} ({reps} repetitions)')
+
+    return results
+
+if __name__ == '__name__':
+    main()
@@ -0,0 +1,227 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing a persistent store of null distributions
+# 1. Dataset fingerprints
+# 2. Stored, extendable null distributions
+# 3. Percentile intervals and empirical p-values
+# 4. Expected counts from stored distributions
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import numpy as np
+from modules.dataset import ColumnarDataset, build_dataset, cheater_arrays
+from modules.counting import count_cheaters, count_victims_cheaters, \
+    count_observers_cheaters, team_count_statistic, player_count_statistic
+from modules.parallel import run_reps, master_seed
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. Dataset fingerprints
+# A fingerprint covers the integer-encoded data and the cheaters' status, so
+# any change to teams, kills or cheaters gives a new key
+# -----------------------------------------------------------------------------
+
+def dataset_fingerprint(dataset: ColumnarDataset, dict_cheaters) -> str:
+    '''Takes a ColumnarDataset (dataset) and cheaters (dict_cheaters), as dict
+           or CheaterIndex.
+       Returns the BLAKE2b hash of the dataset's arrays and of the cheater
+           status and start date of every player, as hex string.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    for name, array in sorted(vars(dataset).items()):
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
+    for array in cheater_arrays(dataset, dict_cheaters):
+        digest.update(np.ascontiguousarray(array).tobytes())
+
+    return digest.hexdigest()
+
+# -----------------------------------------------------------------------------
+# 2. Stored, extendable null distributions
+# Format: {store_dir}/{key}.npy with one row per repetition and
+# {store_dir}/{key}.json with what the key was made from.
+# Repetition i always draws from child i of the seed (see run_reps()), so
+# extending a stored distribution gives exactly the samples of one longer run.
+# -----------------------------------------------------------------------------
+
+def null_key(fingerprint: str, statistic: str, params: dict, seed: int) -> str:
+    '''Takes a dataset fingerprint (fingerprint), the statistic's name
+           (statistic), its parameters (params) and the seed (seed).
+       Returns the store key as hex string.
+    '''
+    text = json.dumps({'fingerprint': fingerprint, 'statistic': statistic,
+                       'params': params, 'seed': seed}, sort_keys=True)
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+def stored_null(statistic, name: str, fingerprint: str, reps: int,
+                params: dict = None, seed: int = 0, workers: int = 1,
+                store_dir: str = '.cache/null') -> np.ndarray:
+    '''Takes a function for run_reps() (statistic), its name (name), a
+           dataset fingerprint (fingerprint), the number of repetitions
+           (reps), the statistic's parameters (params), a seed (seed), the
+           number of processes (workers) and the store directory (store_dir).
+       Loads the stored repetitions and simulates only those missing to
+           reach reps, then saves the extended distribution. With seed None
+           a fresh seed is drawn, so nothing is reused.
+       Returns an array with the first reps repetitions, one row each.
+    '''
+    params = params or {}
+    seed = master_seed(seed)
+    key = null_key(fingerprint, name, params, seed)
+    path = os.path.join(store_dir, key)
+
+    samples = np.load(path + '.npy') if os.path.exists(path + '.npy') else None
+    stored = 0 if samples is None else len(samples)
+
+    if stored < reps:
+        extra = run_reps(statistic, reps - stored, seed, workers, start=stored)
+        samples = extra if samples is None else np.concatenate([samples, extra])
+
+        os.makedirs(store_dir, exist_ok=True)
+        np.save(path + '.tmp.npy', samples)
+        os.replace(path + '.tmp.npy', path + '.npy')
+        with open(path + '.json.tmp', 'w') as file:
+            json.dump({'fingerprint': fingerprint, 'statistic': name, 'params': params,
+                       'seed': seed, 'reps': len(samples)}, file)
+        os.replace(path + '.json.tmp', path + '.json')
+        print(f'--- Repetitions reused: {stored}, simulated: {reps - stored} ---')
+
+    return samples[:reps]
+
+# -----------------------------------------------------------------------------
+# 3. Percentile intervals and empirical p-values
+# -----------------------------------------------------------------------------
+
+def percentile_interval(samples: np.ndarray, level: float = 0.95) -> tuple:
+    '''Takes a null distribution (samples), one row per repetition, and the
+           coverage of the interval (level).
+       Returns the lower and upper percentiles of every column.
+    '''
+    tail = (1 - level) / 2 * 100
+    return np.percentile(samples, tail, axis=0), np.percentile(samples, 100 - tail, axis=0)
+
+def empirical_p_value(samples: np.ndarray, observed,
+                      alternative: str = 'greater') -> np.ndarray:
+    '''Takes a null distribution (samples), one row per repetition, the
+           observed value(s) (observed) and the alternative ('greater',
+           'less' or 'two-sided').
+       Counts the observed value as one more sample, so p is never 0:
+           p = (1 + #{samples at least as extreme}) / (reps + 1)
+       Returns the p-value of every column.
+    '''
+    reps = len(samples)
+    greater = (1 + (samples >= observed).sum(axis=0)) / (reps + 1)
+    less = (1 + (samples <= observed).sum(axis=0)) / (reps + 1)
+
+    if alternative == 'greater':
+        return greater
+    if alternative == 'less':
+        return less
+    return np.minimum(1, 2 * np.minimum(greater, less))
+
+def null_summary(samples: np.ndarray, observed, level: float = 0.95,
+                 alternative: str = 'greater') -> dict:
+    '''Takes a null distribution (samples), the observed value(s)
+           (observed), the interval's coverage (level) and the alternative
+           of empirical_p_value() (alternative).
+       Returns a dict with mean, sd, percentile interval and p-value, each
+           per column.
+    '''
+    lower, upper = percentile_interval(samples, level)
+    return {'mean': samples.mean(axis=0), 'sd': samples.std(axis=0),
+            'lower': lower, 'upper': upper,
+            'p_value': empirical_p_value(samples, observed, alternative),
+            'reps': len(samples)}
+
+# -----------------------------------------------------------------------------
+# 4. Expected counts from stored distributions
+# -----------------------------------------------------------------------------
+
+def _print_summary(title: str, observed, summary: dict, level: float, index=None):
+    '''Takes a title (title), the observed value (observed), the output of
+           null_summary() (summary), the interval's coverage (level) and
+           optionally the column to print (index).
+       Pretty-prints the output for users.
+    '''
+    pick = (lambda value: value) if index is None else (lambda value: value[index])
+    print(f'--- {title} ---')
+    print(f'\tObserved: {observed}')
+    print(f'\tExpected mean: {pick(summary["mean"]):.2f}')
+    print(f'\t{level:.0%} percentile interval: '
+          f'[{pick(summary["lower"]):.2f}, {pick(summary["upper"]):.2f}]')
+    print(f'\tEmpirical p-value: {pick(summary["p_value"]):.4f} '
+          f'({summary["reps"]} repetitions)')
+
+def exp_count_cheaters_stored(team_ids, dict_cheaters, reps: int = 1000,
+                              seed: int = 0, workers: int = 1, level: float = 0.95,
+                              store_dir: str = '.cache/null') -> dict:
+    '''Takes teams data (team_ids), as dict or ColumnarDataset, cheaters
+           (dict_cheaters), the number of repetitions (reps), a seed (seed),
+           the number of processes (workers), the interval's coverage (level)
+           and the store directory (store_dir).
+       Shuffles team codes as exp_count_cheaters_batched(), reusing stored
+           repetitions.
+       Returns and prints, per number of cheaters, the output of
+           null_summary() against the observed count.
+    '''
+    dataset = team_ids if isinstance(team_ids, ColumnarDataset) \
+        else build_dataset(dict_teams=team_ids)
+    samples = stored_null(team_count_statistic(dataset, dict_cheaters), 'team_counts',
+                          dataset_fingerprint(dataset, dict_cheaters), reps,
+                          seed=seed, workers=workers, store_dir=store_dir)
+
+    counts = count_cheaters(dataset, dict_cheaters)
+    observed = np.array([counts.get(k, 0) for k in range(samples.shape[1])])
+    summary = null_summary(samples, observed, level)
+
+    expected = {}
+    for k in range(samples.shape[1]):
+        expected[k] = {stat: value[k] if np.ndim(value) else value
+                       for stat, value in summary.items()}
+        _print_summary(f'Number of cheaters: {k}', observed[k], summary, level, k)
+
+    return expected
+
+def exp_count_players_stored(counter, dict_kills, dict_cheaters, reps: int = 1000,
+                             seed: int = 0, workers: int = 1, level: float = 0.95,
+                             store_dir: str = '.cache/null', title: str = None) -> dict:
+    '''Takes a counting function (counter), either count_victims_cheaters()
+           or count_observers_cheaters(), kills data (dict_kills), as dict or
+           ColumnarDataset, cheaters (dict_cheaters), the arguments of
+           exp_count_cheaters_stored() and a title for the output (title).
+       Swaps player codes as simulate_player_counts(), reusing stored
+           repetitions.
+       Returns and prints the output of null_summary() against the observed
+           count.
+    '''
+    dataset = dict_kills if isinstance(dict_kills, ColumnarDataset) \
+        else build_dataset(dict_kills=dict_kills)
+    samples = stored_null(player_count_statistic(counter, dataset, dict_cheaters),
+                          counter.__name__, dataset_fingerprint(dataset, dict_cheaters),
+                          reps, seed=seed, workers=workers, store_dir=store_dir)
+
+    observed = len(counter(dataset, dict_cheaters))
+    summary = null_summary(samples, observed, level)
+    _print_summary(title or counter.__name__, observed, summary, level)
+
+    return summary
+
+def exp_count_victims_cheaters_stored(dict_kills, dict_cheaters, **kwargs) -> dict:
+    '''Calls exp_count_players_stored() with count_victims_cheaters().'''
+    return exp_count_players_stored(count_victims_cheaters, dict_kills, dict_cheaters,
+                                    title='Victims becoming cheaters', **kwargs)
+
+def exp_count_observers_cheaters_stored(dict_kills, dict_cheaters, **kwargs) -> dict:
+    '''Calls exp_count_players_stored() with count_observers_cheaters().'''
+    return exp_count_players_stored(count_observers_cheaters, dict_kills, dict_cheaters,
+                                    title='Observers becoming cheaters', **kwargs)
+
+if __name__ == '__name__':
+    main()
@@ -0,0 +1,96 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing functions to run Monte Carlo repetitions in parallel
+# 1. Random streams per repetition
+# 2. Process-pool runner
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import multiprocessing
+import numpy as np
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. Random streams per repetition
+# Repetition i always uses child i of the master seed, so results do not
+# depend on how repetitions are split across workers
+# -----------------------------------------------------------------------------
+
+def rep_rngs(seed: int, start: int, stop: int) -> list:
+    '''Takes a master seed (seed) and a range of repetitions (start, stop).
+       Derives one independent stream per repetition, identical to
+           np.random.SeedSequence(seed).spawn(stop)[start:stop].
+       Returns a list of np.random.Generator.
+    '''
+    return [np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(rep,)))
+            for rep in range(start, stop)]
+
+def master_seed(seed: int = None) -> int:
+    '''Takes a seed (seed) or None.
+       Returns the seed, or fresh entropy from the OS if seed is None.
+    '''
+    return np.random.SeedSequence(seed).entropy
+
+# -----------------------------------------------------------------------------
+# 2. Process-pool runner
+# The statistic is handed to the workers by fork, so the base dataset it
+# closes over is shared copy-on-write and never pickled
+# -----------------------------------------------------------------------------
+
+_STATISTIC = None
+
+def _run_chunk(task: tuple) -> np.ndarray:
+    '''Takes a task (seed, start, stop).
+       Returns the statistic of repetitions start to stop as array.
+    '''
+    seed, start, stop = task
+    return np.asarray(_STATISTIC(rep_rngs(seed, start, stop)))
+
+def task_size(reps: int, workers: int = 1, limit: int = 50) -> int:
+    '''Takes the number of repetitions (reps), the number of processes
+           (workers) and the largest number of repetitions per task (limit).
+       Splits the repetitions into about 4 tasks per worker, so every worker
+           gets work and a slow task does not hold up the rest.
+       Returns the number of repetitions per task.
+    '''
+    if workers <= 1:
+        return limit
+    return max(1, min(limit, -(-reps // (4 * workers))))
+
+def run_reps(statistic, reps: int, seed: int = None, workers: int = 1,
+             chunk_size: int = None, start: int = 0) -> np.ndarray:
+    '''Takes a function (statistic) mapping a list of generators to one
+           result per generator, the number of repetitions (reps), a master
+           seed (seed), the number of processes (workers), the number of
+           repetitions per task (chunk_size), by default task_size(), and
+           the index of the first repetition (start).
+       Runs all repetitions, in a forked process pool if workers > 1. Runs
+           sequentially where fork is not available.
+       Results are bit-identical for a given seed, whatever the worker count.
+       Returns an array of results, one row per repetition.
+    '''
+    global _STATISTIC
+
+    seed = master_seed(seed)
+    chunk_size = chunk_size or task_size(reps, workers)
+    tasks = [(seed, lo, min(lo + chunk_size, start + reps))
+             for lo in range(start, start + reps, chunk_size)]
+
+    _STATISTIC = statistic
+    try:
+        if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                results = pool.map(_run_chunk, tasks)
+        else:
+            results = [_run_chunk(task) for task in tasks]
+    finally:
+        _STATISTIC = None
+
+    return np.concatenate(results) if results else np.empty(0)
+
+if __name__ == '__name__':
+    main()
@@ -0,0 +1,161 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing functions for out-of-core, match-partitioned processing
+# 1. Hash partitioning into shards
+# 2. Streaming counts over shards
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import os
+import zlib
+import shutil
+import tempfile
+from collections import Counter
+from modules.dataset import cheater_index
+from modules.ingest import ingest
+from modules.counting import count_cheaters, count_contagion
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. Hash partitioning into shards
+# Format: {directory}/{prefix}-{shard:04d}.txt with the original rows. All
+# rows of a match land in the same shard, in their original order.
+# -----------------------------------------------------------------------------
+
+def shard_of(match: bytes, n_shards: int) -> int:
+    '''Takes a match id as bytes (match) and the number of shards (n_shards).
+       Uses CRC32, which, unlike hash(), is the same in every process.
+       Returns the shard of the match.
+    '''
+    return zlib.crc32(match) % n_shards
+
+def _flush(paths: list, buffers: list):
+    '''Takes the shard paths (paths) and their buffered rows (buffers).
+       Appends every non-empty buffer to its shard and clears it, holding
+           one file open at a time.
+    '''
+    for shard_path, buffer in zip(paths, buffers):
+        if buffer:
+            with open(shard_path, 'ab') as file:
+                file.writelines(buffer)
+            buffer.clear()
+
+def partition_file(path: str, directory: str, prefix: str, n_shards: int,
+                   buffer_bytes: int = 64 << 20) -> list:
+    '''Takes a path (path) to team_ids.txt or kills.txt, an output directory
+           (directory), a file prefix (prefix), the number of shards
+           (n_shards) and the bytes buffered over all shards (buffer_bytes).
+       Streams the file line by line into one file per shard by the hash of
+           the match id. All buffers are flushed once they hold buffer_bytes,
+           so memory and open files do not grow with the number of shards.
+       Returns the list of shard paths.
+    '''
+    paths = [os.path.join(directory, f'{prefix}-{shard:04d}.txt') for shard in range(n_shards)]
+    buffers = [[] for _ in range(n_shards)]
+    for shard_path in paths:
+        open(shard_path, 'wb').close()
+
+    buffered = 0
+    with open(path, 'rb') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            shard = shard_of(line[:line.index(b'\t')], n_shards)
+            buffers[shard].append(line if line.endswith(b'\n') else line + b'\n')
+            buffered += len(line)
+            if buffered >= buffer_bytes:
+                _flush(paths, buffers)
+                buffered = 0
+
+    _flush(paths, buffers)
+
+    return paths
+
+def partition(teams_path: str, kills_path: str, directory: str,
+              n_shards: int = None, shard_bytes: int = 256 << 20) -> list:
+    '''Takes paths to the team_ids.txt (teams_path) and kills.txt (kills_path)
+           files, an output directory (directory), the number of shards
+           (n_shards) and, if n_shards is None, the target input bytes per
+           shard (shard_bytes).
+       Partitions both files by match id with the same hash.
+       Returns a list of (teams_shard, kills_shard) paths.
+    '''
+    if n_shards is None:
+        size = os.path.getsize(teams_path) + os.path.getsize(kills_path)
+        n_shards = max(1, -(-size // shard_bytes))
+
+    os.makedirs(directory, exist_ok=True)
+    teams = partition_file(teams_path, directory, 'teams', n_shards)
+    kills = partition_file(kills_path, directory, 'kills', n_shards)
+
+    return list(zip(teams, kills))
+
+# -----------------------------------------------------------------------------
+# 2. Streaming counts over shards
+# Only one shard is held in memory at a time. Team histograms are summed
+# and sets of new cheaters are united across shards.
+# -----------------------------------------------------------------------------
+
+def iter_shards(shards: list, workers: int = None):
+    '''Takes a list of (teams_shard, kills_shard) paths (shards) and the
+           number of processes for parsing (workers).
+       Yields one ColumnarDataset per shard, loaded by ingest().
+    '''
+    for teams_path, kills_path in shards:
+        yield ingest(teams_path, kills_path, workers=workers)[0]
+
+def merge_histograms(histograms) -> dict:
+    '''Takes an iterable of outputs of count_cheaters() (histograms).
+       Returns their sum with keys 0-4 and any larger count that occurs.
+    '''
+    total = Counter()
+    for histogram in histograms:
+        total.update(histogram)
+
+    return {num_cheater: total[num_cheater] for num_cheater in sorted(total)
+            if num_cheater < 5 or total[num_cheater]}
+
+def count_shards(shards: list, dict_cheaters: dict) -> tuple:
+    '''Takes a list of (teams_shard, kills_shard) paths (shards) and a dict
+           with cheaters (dict_cheaters), or a CheaterIndex.
+       Counts every shard with count_cheaters() and count_contagion().
+       Returns the counts of cheaters per team, as count_cheaters(), and the
+           sets of victims and observers who became cheaters.
+    '''
+    histograms, victims, observers = [], set(), set()
+    dict_cheaters = cheater_index(dict_cheaters)
+
+    for dataset in iter_shards(shards):
+        histograms.append(count_cheaters(dataset, dict_cheaters))
+        shard_victims, shard_observers = count_contagion(dataset, dict_cheaters)
+        victims |= shard_victims
+        observers |= shard_observers
+
+    return merge_histograms(histograms), victims, observers
+
+def count_out_of_core(teams_path: str, kills_path: str, dict_cheaters: dict,
+                      directory: str = None, n_shards: int = None,
+                      shard_bytes: int = 256 << 20) -> tuple:
+    '''Takes paths to the team_ids.txt (teams_path) and kills.txt (kills_path)
+           files, a dict with cheaters (dict_cheaters), a directory for the
+           shards (directory) and the arguments of partition().
+       Partitions the files and counts them shard by shard. Shards in a
+           temporary directory are removed afterwards.
+       Returns the output of count_shards().
+    '''
+    cleanup = directory is None
+    directory = directory or tempfile.mkdtemp(prefix='shards-')
+
+    try:
+        shards = partition(teams_path, kills_path, directory, n_shards, shard_bytes)
+        return count_shards(shards, dict_cheaters)
+    finally:
+        if cleanup:
+            shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__name__':
+    main()
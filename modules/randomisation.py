@@ -4,12 +4,17 @@
 # File containing functions to randomise data
 # 1. Randomise team ids
 # 2. Randomise player ids
+# 3. Randomise columnar data
+# 4. Batched team permutations
+# 5. Player permutation engine
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 
 import random
 import copy
+import numpy as np
+from modules.dataset import ColumnarDataset
 
 def main():
     pass
@@ -24,8 +29,12 @@ def randomise_team_ids(team_ids: dict, deep: bool = True) -> dict:
     '''Takes a dict with team_ids (team_ids) and a boolean (deep).
        Shuffles team ids in a given match, for each match.
        Parameter deep decides whether to return a deep copy of the data.
+       A ColumnarDataset is passed on to randomise_team_codes().
        Returns a (copied) shuffled dict.
     '''
+    if isinstance(team_ids, ColumnarDataset):
+        return randomise_team_codes(team_ids)
+    
     if deep:
         team_ids = copy.deepcopy(team_ids) 
         
@@ -49,20 +58,116 @@ def randomise_player_ids(killers: list = ['A', 'B', 'B'],
        To see an example, run the function with default inputs.
     '''
     
-    killers_out, victims_out = [], [] 
-    
     unique_players = list(set(killers + victims))
     unique_players_swaps = unique_players[:]
     
     random.shuffle(unique_players_swaps)
+    swaps = dict(zip(unique_players, unique_players_swaps))
     
     # Swap players' ids
-    for i in range(len(killers)):
-        
-        killers_out.append(unique_players_swaps[unique_players.index(killers[i])])
-        victims_out.append(unique_players[unique_players.index(victims[i])])
+    killers_out = [swaps[killer] for killer in killers]
+    victims_out = list(victims)
 
     return killers_out, victims_out
 
+# -----------------------------------------------------------------------------
+# 3. Randomise columnar data
+# Returns: a ColumnarDataset sharing all arrays but the randomised one
+# -----------------------------------------------------------------------------
+
+def randomise_team_codes(dataset: ColumnarDataset, 
+                         rng: np.random.Generator = None) -> ColumnarDataset:
+    '''Takes a ColumnarDataset (dataset) and a random generator (rng).
+       Shuffles team codes in a given match, for each match.
+       Returns a dataset with shuffled team codes; other arrays are shared.
+    '''
+    permutation = team_permutations(dataset, 1, rng)[0]
+    return dataset.replace(team_codes=dataset.team_codes[permutation])
+
+def randomise_player_codes(dataset: ColumnarDataset, 
+                           rng: np.random.Generator = None,
+                           index: tuple = None) -> ColumnarDataset:
+    '''Takes a ColumnarDataset (dataset), a random generator (rng) and 
+           optionally the output of player_permutation_index() (index), to 
+           reuse it across repetitions.
+       Randomly swaps killer codes among the players of a match, for every 
+           match in one vectorized call. As in randomise_player_ids(), 
+           victims keep their codes.
+       Returns a dataset with swapped killers; other arrays are shared.
+    '''
+    index = index or player_permutation_index(dataset)
+    return dataset.replace(killers=permute_players(index, rng))
+
+# -----------------------------------------------------------------------------
+# 4. Batched team permutations
+# Returns: permutation index arrays shuffling team memberships within matches
+# -----------------------------------------------------------------------------
+
+def team_permutations(dataset: ColumnarDataset, reps: int, 
+                      rng: np.random.Generator = None) -> np.ndarray:
+    '''Takes a ColumnarDataset (dataset), the number of repetitions (reps) 
+           and a random generator (rng).
+       Draws reps permutations of the team membership rows, each of which only
+           moves rows within their match. Row i of a shuffled world has team 
+           code dataset.team_codes[permutations[r, i]].
+       The dataset itself is not copied.
+       Returns an int array of shape (reps, number of memberships).
+    '''
+    rng = rng or np.random.default_rng()
+    match_index = dataset.team_match_index()
+    match_keys = match_index.astype(np.int64) * len(match_index)
+    
+    # Uniform shuffle of all rows, then regroup the rows by match: the rank
+    # of a row in the shuffle makes its (match, rank) key unique, so the 
+    # second sort needs no stable sort
+    permutations = np.empty((reps, len(match_index)), dtype=np.intp)
+    rank = np.empty(len(match_index), dtype=np.int64)
+    for rep in range(reps):
+        rank[np.argsort(rng.random(len(match_index)))] = np.arange(len(match_index))
+        permutations[rep] = np.argsort(match_keys + rank)
+    
+    return permutations
+
+# -----------------------------------------------------------------------------
+# 5. Player permutation engine
+# The (match, player) slots are computed once per dataset; every repetition
+# then shuffles the slots within their match and remaps the killers with a 
+# single array lookup
+# -----------------------------------------------------------------------------
+
+def player_permutation_index(dataset: ColumnarDataset) -> tuple:
+    '''Takes a ColumnarDataset (dataset).
+       Collects the unique players of each match (killers and victims) into 
+           flat slots grouped by match.
+       Returns the player code of each slot, the match of each slot and the 
+           slot of each kill's killer.
+    '''
+    match_index = dataset.kill_match_index().astype(np.int64)
+    n_kills = len(match_index)
+    
+    keys = np.concatenate([match_index * dataset.n_players + dataset.killers,
+                           match_index * dataset.n_players + dataset.victims])
+    slot_keys, slots = np.unique(keys, return_inverse=True)
+    
+    slot_players = (slot_keys % max(dataset.n_players, 1)).astype(np.int32)
+    slot_matches = slot_keys // max(dataset.n_players, 1)
+    
+    return slot_players, slot_matches, slots.ravel()[:n_kills]
+
+def permute_players(index: tuple, rng: np.random.Generator = None) -> np.ndarray:
+    '''Takes the output of player_permutation_index() (index) and a random 
+           generator (rng).
+       Shuffles the players of every match among that match's slots.
+       Returns the new killer codes, one per kill.
+    '''
+    rng = rng or np.random.default_rng()
+    slot_players, slot_matches, killer_slots = index
+    
+    # Uniform shuffle of all slots, then stably regroup the slots by match
+    order = rng.permutation(len(slot_players))
+    order = order[np.argsort(slot_matches[order], kind='stable')]
+    
+    return slot_players[order][killer_slots]
+
 if __name__ == '__name__':
     main()
\ No newline at end of file
@@ -0,0 +1,175 @@
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# File containing functions to generate synthetic data at any scale
+# 1. Random matches
+# 2. Writing the files
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import os
+import numpy as np
+
+def main():
+    pass
+
+# -----------------------------------------------------------------------------
+# 1. Random matches
+# Matches are generated in chunks, so memory is bounded by the chunk size and
+# not by the number of matches
+# -----------------------------------------------------------------------------
+
+BASE_DATE = np.datetime64('2019-03-01', 'us')
+ONE_DAY_US = 86400 * 1000000
+
+def distinct_players(rng: np.random.Generator, n_matches: int,
+                     players_per_match: int, n_players: int) -> np.ndarray:
+    '''Takes a random generator (rng), the number of matches (n_matches), the
+           number of players per match (players_per_match) and the size of
+           the player pool (n_players).
+       Samples each match's players without replacement with Floyd's
+           algorithm, vectorized over matches, then shuffles each row.
+       Returns an int array of shape (n_matches, players_per_match) without
+           duplicates within a row.
+    '''
+    if n_players < players_per_match:
+        raise ValueError(f'A pool of {n_players} players cannot fill matches of '
+                         f'{players_per_match} distinct players')
+
+    players = np.empty((n_matches, players_per_match), dtype=np.int64)
+    for column, top in enumerate(range(n_players - players_per_match, n_players)):
+        # Draw from 0..top; a player already in the row is replaced by top,
+        # which cannot be in the row yet
+        draw = rng.integers(0, top + 1, n_matches)
+        taken = (players[:, :column] == draw[:, None]).any(axis=1)
+        players[:, column] = np.where(taken, top, draw)
+
+    return rng.permuted(players, axis=1)
+
+def generate_chunk(rng: np.random.Generator, first_match: int, n_matches: int,
+                   players_per_match: int, team_size: int, n_players: int,
+                   kills_per_match: float, days: int,
+                   match_length: int) -> tuple:
+    '''Takes a random generator (rng), the code of the first match
+           (first_match), the number of matches (n_matches), the players per
+           match (players_per_match) and per team (team_size), the size of
+           the player pool (n_players), the mean number of kills per match
+           (kills_per_match), the number of days spanned (days) and the
+           length of a match in seconds (match_length).
+       Returns the team rows (match, player, team) and the kill rows (match,
+           killer, victim, time in microseconds since the epoch) as int64
+           arrays.
+    '''
+    players = distinct_players(rng, n_matches, players_per_match, n_players)
+    matches = np.arange(first_match, first_match + n_matches)
+
+    team_rows = (np.repeat(matches, players_per_match), players.ravel(),
+                 np.tile(np.arange(players_per_match) // team_size, n_matches))
+
+    # Kills: killer and victim are two different players of the match
+    n_kills = rng.poisson(kills_per_match, n_matches)
+    kill_match = np.repeat(np.arange(n_matches), n_kills)
+    killer = rng.integers(0, players_per_match, len(kill_match))
+    victim = (killer + rng.integers(1, players_per_match, len(kill_match))) % players_per_match
+
+    match_start = BASE_DATE.astype(np.int64) + rng.integers(0, days * ONE_DAY_US, n_matches)
+    times = match_start[kill_match] + rng.integers(0, match_length * 1000000, len(kill_match))
+
+    kill_rows = (matches[kill_match], players[kill_match, killer],
+                 players[kill_match, victim], times)
+
+    return team_rows, kill_rows
+
+def generate_cheaters(rng: np.random.Generator, n_players: int,
+                      cheater_rate: float, days: int) -> tuple:
+    '''Takes a random generator (rng), the size of the player pool
+           (n_players), the share of cheaters (cheater_rate) and the number
+           of days spanned by the matches (days).
+       Start dates fall within the matches' days and a few days around them,
+           so some cheaters start before and some after their matches.
+       Returns the cheater codes and their start and ban dates as int64
+           microseconds since the epoch.
+    '''
+    cheaters = np.flatnonzero(rng.random(n_players) < cheater_rate)
+    start = BASE_DATE.astype(np.int64) + \
+        rng.integers(-5, days + 5, len(cheaters)) * ONE_DAY_US
+    banned = start + rng.integers(1, 31, len(cheaters)) * ONE_DAY_US
+
+    return cheaters, start, banned
+
+# -----------------------------------------------------------------------------
+# 2. Writing the files
+# Format: as in assignment-final-data, tab-separated
+# -----------------------------------------------------------------------------
+
+def _ids(prefix: str, codes: np.ndarray, names: np.ndarray = None) -> list:
+    '''Takes a prefix (prefix), int codes (codes) and optionally the IDs of
+           all codes as object array (names), to look them up instead.
+       Returns the IDs as list of str, e.g. 'p42'.
+    '''
+    if names is not None:
+        return names[codes].tolist()
+    return [prefix + code for code in map(str, codes.tolist())]
+
+def _dates(times: np.ndarray, unit: str) -> list:
+    '''Takes times as int64 microseconds since the epoch (times) and a unit
+           ('D' or 'us').
+       Returns the times as list of str, formatted like the input files.
+    '''
+    text = np.datetime_as_string(times.astype('datetime64[us]'), unit=unit).tolist()
+    return [date.replace('T', ' ') for date in text] if unit != 'D' else text
+
+def _write_rows(file, columns: list):
+    '''Takes an open text file (file) and a list of str lists (columns).
+       Writes one tab-separated line per row.
+    '''
+    if len(columns[0]):
+        file.write('\n'.join(map('\t'.join, zip(*columns))))
+        file.write('\n')
+
+def generate_data(directory: str, n_matches: int, players_per_match: int = 20,
+                  team_size: int = 4, n_players: int = None,
+                  cheater_rate: float = 0.05, kills_per_match: float = 20,
+                  days: int = 30, match_length: int = 1800, seed: int = 0,
+                  chunk_matches: int = 100000) -> dict:
+    '''Takes an output directory (directory), the number of matches
+           (n_matches), the players per match (players_per_match) and per
+           team (team_size), the size of the player pool (n_players; by
+           default every player plays about 20 matches), the share of
+           players who cheat (cheater_rate), the mean number of kills per
+           match (kills_per_match), the number of days spanned (days), the
+           length of a match in seconds (match_length), a seed (seed) and the
+           number of matches generated at once (chunk_matches).
+       Writes team_ids.txt, kills.txt and cheaters.txt to directory.
+       Returns a dict with the paths and the number of rows of each file.
+    '''
+    rng = np.random.default_rng(seed)
+    n_players = n_players or max(2 * players_per_match, n_matches * players_per_match // 20)
+    os.makedirs(directory, exist_ok=True)
+    paths = {name: os.path.join(directory, f'{name}.txt')
+             for name in ['team_ids', 'kills', 'cheaters']}
+    rows = {name: 0 for name in paths}
+
+    players = np.array(_ids('p', np.arange(n_players)), dtype=object)
+    cheaters, start, banned = generate_cheaters(rng, n_players, cheater_rate, days)
+    with open(paths['cheaters'], 'w') as file:
+        _write_rows(file, [_ids('p', cheaters, players), _dates(start, 'D'), _dates(banned, 'D')])
+    rows['cheaters'] = len(cheaters)
+
+    with open(paths['team_ids'], 'w') as teams, open(paths['kills'], 'w') as kills:
+        for first in range(0, n_matches, chunk_matches):
+            team_rows, kill_rows = generate_chunk(rng, first, min(chunk_matches, n_matches - first),
+                                                  players_per_match, team_size, n_players,
+                                                  kills_per_match, days, match_length)
+            _write_rows(teams, [_ids('m', team_rows[0]), _ids('p', team_rows[1], players),
+                                list(map(str, team_rows[2].tolist()))])
+            _write_rows(kills, [_ids('m', kill_rows[0]), _ids('p', kill_rows[1], players),
+                                _ids('p', kill_rows[2], players), _dates(kill_rows[3], 'us')])
+            rows['team_ids'] += len(team_rows[0])
+            rows['kills'] += len(kill_rows[0])
+
+    return {'paths': paths, 'rows': rows}
+
+if __name__ == '__name__':
+    main()